@@ -0,0 +1,51 @@
+"""Peak RSS of holding parsed descriptions, parsed_store against nested dicts
+
+Builds n synthetic descriptions of four tokens (from a 50 000 token
+vocabulary) with comp_word_parser style tags, held either as the nested
+{description: {word: tags}} dicts or in a token_store.parsed_store.  Each
+mode runs in its own process so the peak RSS reported is its own.
+
+    python benchmarks/bench_memory.py [n_descriptions]
+"""
+import os
+import sys
+import random
+import resource
+import subprocess
+import numpy as np
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from token_store import parsed_store
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak = peak/1024
+    return peak/1024.0
+
+
+def run(mode,n_descriptions):
+    random.seed(0)
+    vocab = ['tok%d' % i for i in range(50000)]
+    store = parsed_store()
+    held = []
+    for i in range(n_descriptions):
+        words = random.sample(vocab,4)
+        word_comp = dict((w,[2,True,False,np.float64(0.3),'NN',np.float64(0.1),1]) for w in words)
+        comp_descr = ' '.join(words)
+        if mode == 'store':
+            store.append(comp_descr,word_comp)
+        else:
+            held.append({comp_descr:word_comp})
+    print('%-6s %d descriptions, peak RSS %.0f MB' % (mode,n_descriptions,peak_rss_mb()))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2:
+        run(sys.argv[2],int(sys.argv[1]))
+    else:
+        n_descriptions = sys.argv[1] if len(sys.argv) > 1 else '1000000'
+        for mode in ('store','dict'):
+            subprocess.check_call([sys.executable,os.path.abspath(__file__),n_descriptions,mode])
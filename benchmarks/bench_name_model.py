@@ -0,0 +1,151 @@
+"""Speed and accuracy of name_model against the comp_name_score heuristic
+
+Builds n synthetic descriptions (company name words followed by store
+numbers, cities and common words) with comp_word_parser style tags in a
+token_store.parsed_store.  Company names are made of brand words and of
+the same common words found around them in other descriptions.  The tags
+of name words and other words are drawn from overlapping distributions
+made up for the benchmark, so neither method is exact and the accuracies
+say nothing about real statements.  The
+model is trained on the first half and both methods predict the names of
+the second half, accuracy being the share of names predicted exactly.  A
+fifth of the companies only appear in the second half, their accuracy is
+reported apart as the model has not seen their words.
+
+The heuristic timed here is not the real company_name_full.  It is
+heuristic_name below, a hand written copy of the scoring rule of
+description_parser.comp_name_score and company_name_full (a word is kept
+if the sum of its tags is 3 or more) run on the synthetic tags, as
+importing description_parser needs nltk, fuzzy and the word lists.  It
+has to be kept in step with description_parser by hand.  Parsing is left
+out of both timings, it is the same for both methods.
+
+    python benchmarks/bench_name_model.py [n_descriptions]
+"""
+import os
+import sys
+import random
+import timeit
+import numpy as np
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from token_store import parsed_store
+from name_model import name_model
+
+ACCEPTED_PARTS = ('&','and','the')
+CITIES = ['san francisco','new york','oakland','berkeley','seattle','portland']
+
+
+def random_word(rng,length):
+    return ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(length))
+
+
+def word_tags(rng,word,in_name):
+    """comp_word_parser style tags [is_word_term,embedded_word,word_struc,
+    prev_count,pos,word_phon_count,len_word_points] of a synthetic word"""
+    if word.isdigit():
+        return [0,False,False,np.float64(rng.gauss(-0.5,0.5)),'CD',
+                np.float64(rng.gauss(-0.5,0.5)),0]
+    if in_name:
+        return [int(rng.random() < 0.3),rng.random() < 0.6,rng.random() < 0.7,
+                np.float64(rng.gauss(1.0,1.0)),rng.choice(['NN','NNP','JJ']),
+                np.float64(rng.gauss(0.8,1.0)),rng.randint(0,2)]
+    return [int(rng.random() < 0.8),rng.random() < 0.3,rng.random() < 0.4,
+            np.float64(rng.gauss(0.2,1.0)),rng.choice(['NN','IN','VB']),
+            np.float64(rng.gauss(0.0,1.0)),rng.randint(0,2)]
+
+
+def make_companies(rng,n_companies,common_words):
+    companies = []
+    for _ in range(n_companies):
+        words = [random_word(rng,rng.randint(4,9)) if rng.random() < 0.6 else rng.choice(common_words)
+                 for _ in range(rng.choice([1,1,2,2,3]))]
+        if len(words) > 1 and rng.random() < 0.1:
+            words.insert(1,'&')
+        companies.append(' '.join(words))
+    return companies
+
+
+def make_descriptions(rng,companies,common_words,n_descriptions,first=0):
+    descriptions = []
+    for i in range(first,first + n_descriptions):
+        company = rng.choice(companies)
+        extra = [str(rng.randint(1,99999))]
+        extra.extend(rng.choice(CITIES).split())
+        extra.extend(rng.sample(common_words,rng.randint(0,3)))
+        rng.shuffle(extra)
+        word_comp = dict()
+        for word in company.split():
+            word_comp[word] = word_tags(rng,word,True)
+        for word in extra:
+            word_comp.setdefault(word,word_tags(rng,word,False))
+        descriptions.append(('%s %d' % (' '.join(word_comp),i),word_comp,company))
+    return descriptions
+
+
+def heuristic_name(word_comp):
+    # Hand written copy of the comp_name_score and company_name_full rule,
+    # not the description_parser code itself
+    if len(word_comp) == 1:
+        return list(word_comp)[0]
+    comp_part_name = []
+    for part,word_score in word_comp.items():
+        score = 0
+        for value in word_score:
+            if type(value) == bool:
+                if value == True:
+                    score += 1
+            elif (type(value) == int) or (type(value) == np.float64):
+                score += value
+        if part in ACCEPTED_PARTS:
+            comp_part_name.append(part)
+        elif score >= 3:
+            comp_part_name.append(part)
+    return ' '.join(comp_part_name)
+
+
+def accuracy(predicted,companies):
+    return np.array([p == c for p,c in zip(predicted,companies)])
+
+
+def run(n_descriptions):
+    rng = random.Random(0)
+    common_words = [random_word(rng,rng.randint(3,8)) for _ in range(2000)]
+    companies = make_companies(rng,max(n_descriptions//20,5),common_words)
+    seen = companies[:len(companies)*4//5]
+    n_train = n_descriptions//2
+    descriptions = (make_descriptions(rng,seen,common_words,n_train) +
+                    make_descriptions(rng,companies,common_words,n_descriptions - n_train,n_train))
+
+    store = parsed_store()
+    rows = [store.append(comp_descr,word_comp) for comp_descr,word_comp,_ in descriptions]
+    companies = [company for _,_,company in descriptions]
+    test_rows = rows[n_train:]
+    test_companies = companies[n_train:]
+    seen = set(seen)
+    unseen = np.array([company not in seen for company in test_companies])
+
+    model = name_model()
+    start = timeit.default_timer()
+    model.partial_fit(store,rows[:n_train],companies[:n_train])
+    fit_s = timeit.default_timer() - start
+
+    start = timeit.default_timer()
+    model_names = model.predict_batch(store,test_rows)
+    model_s = timeit.default_timer() - start
+
+    start = timeit.default_timer()
+    heuristic_names = [heuristic_name(descriptions[idx][1]) for idx in test_rows]
+    heuristic_s = timeit.default_timer() - start
+
+    print('%d descriptions, trained on %d, fitted in %.2f s' % (n_descriptions,n_train,fit_s))
+    print('%-10s %10s %10s %10s %12s' % ('method','accuracy','seen','unseen','descr/s'))
+    for method,names,elapsed in (('heuristic',heuristic_names,heuristic_s),
+                                 ('name_model',model_names,model_s)):
+        correct = accuracy(names,test_companies)
+        print('%-10s %10.3f %10.3f %10.3f %12.0f' % (method,correct.mean(),correct[~unseen].mean(),
+                                                    correct[unseen].mean(),len(test_rows)/elapsed))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
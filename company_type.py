@@ -1,7 +1,11 @@
+import os
 import numpy as np
 import urllib
 import json
+import re
 import sqlite3
+import fuzzy
+from profiler import null_profiler
 
 class company_type():
     """Module to get the company type from geo location and company name
@@ -10,10 +14,49 @@ class company_type():
         ----------
         conn : sqlite3 db connection
             SQLITE database connection
+        profiler : stage_profiler
+            Optional profiler recording timings of each loading stage,
+            profiling is disabled if not given.
+        dist_weight : float
+            Weight of the distance score when ranking google results.
+        name_weight : float
+            Weight of the name similarity score when ranking google results.
+        dist_scale : float
+            Distance in km at which the distance score has decayed to 1/e.
+        recurring_months : int
+            Number of consecutive months a company has to charge the same
+            amount, once a month, to be a subscription candidate.
+        rollup : spend_rollup
+            Optional rollups of exp_type_loc, updated with every insert
+            into exp_type_loc.
+        exporter : exp_type_loc_export
+            Optional columnar export of exp_type_loc, run at the end of
+            company_info_loader.
     """
 
-    def __init__(self,conn):
+    earth_radius = 6371.0
+
+    # Companies without a physical location, matched on the predicted name
+    online_patterns = re.compile(
+        r'amzn|amazon|netflix|spotify|itunes|apple\.com|app ?store|'
+        r'google ?play|paypal|hulu|audible|dropbox|'
+        r'www\.|\.com\b|\.net\b|\.co\.uk\b')
+    online_types = ('online','subscription')
+
+    def __init__(self,conn,profiler=None,dist_weight=0.5,name_weight=0.5,dist_scale=1.0,
+                 recurring_months=3,rollup=None,exporter=None):
         self.conn = conn
+        self.profiler = profiler if profiler is not None else null_profiler
+        self.dist_weight = dist_weight
+        self.name_weight = name_weight
+        self.dist_scale = dist_scale
+        self.recurring_months = recurring_months
+        self.rollup = rollup
+        self.exporter = exporter
+        self.online_comp_types_ = {}
+        self.subscriptions_ = set()
+        self.api_calls_saved_ = 0
+        self._day_locations = (None,[])
 
     def defined_companies(self):
         """Creates a list of previously defined companies
@@ -31,8 +74,9 @@ class company_type():
             SELECT *
             FROM defined_company_types
         '''
-        cur = self.conn.cursor()
-        defined_types = cur.execute(sql_st).fetchall()
+        with self.profiler.stage('sql_read'):
+            cur = self.conn.cursor()
+            defined_types = cur.execute(sql_st).fetchall()
         defined_comp_types = dict()
         for record in defined_types:
             defined_comp_types[record[1]] = [record[2],record[3]]
@@ -41,6 +85,86 @@ class company_type():
 
         return self
 
+    def online_companies(self):
+        """Creates the lists of companies with no physical location
+
+        Historic results, companies previously resolved as online or
+        subscription in exp_comp_type, are returned as a dictionary with
+        the company name as key and the company type as value.  These are
+        confirmed and skip the google query.
+
+        Subscription candidates are companies charging the same amount,
+        exactly once a month, for at least recurring_months consecutive
+        months in geo_expense_data.  A fixed price coffee or fare can
+        follow that pattern too, so the candidates are still searched for
+        on google and only taken as subscriptions if google finds nothing.
+
+        returns self
+        """
+
+        sql_historic = '''
+            SELECT DISTINCT geo_expense_data.general_name, exp_comp_type.comp_type
+            FROM exp_comp_type
+            JOIN geo_expense_data ON geo_expense_data.id = exp_comp_type.geo_expense_id
+            WHERE exp_comp_type.comp_type IN (?,?)
+        '''
+        sql_monthly = '''
+            SELECT general_name, yr, mnth, COUNT(*), MIN(value), MAX(value)
+            FROM geo_expense_data
+            WHERE general_name IS NOT NULL
+            GROUP BY general_name, yr, mnth
+            ORDER BY general_name, yr, mnth
+        '''
+        with self.profiler.stage('sql_read'):
+            cur = self.conn.cursor()
+            historic = cur.execute(sql_historic,self.online_types).fetchall()
+            monthly = cur.execute(sql_monthly)
+
+            # Longest run of consecutive months with a single, unchanged charge
+            subscriptions = set()
+            run_name = None
+            for comp_name,yr,mnth,n_charges,min_value,max_value in monthly:
+                month_idx = yr*12 + mnth
+                single = (n_charges == 1) and (min_value == max_value)
+                if (single and comp_name == run_name and month_idx == run_month + 1
+                        and min_value == run_value):
+                    run_length += 1
+                else:
+                    run_name = comp_name
+                    run_length = 1 if single else 0
+                run_month = month_idx
+                run_value = min_value
+                if run_length >= self.recurring_months:
+                    subscriptions.add(comp_name)
+
+        online_comp_types = dict()
+        for record in historic:
+            online_comp_types[record[0]] = record[1]
+
+        self.online_comp_types_ = online_comp_types
+        self.subscriptions_ = subscriptions
+
+        return self
+
+    def online_check(self,comp_name):
+        """Returns the company type if the company has no physical location
+
+        The company is looked up in the companies found by online_companies
+        and then matched against online_patterns.  An empty string is
+        returned for any other company.
+
+        Parameters
+        ----------
+        comp_name : string
+            Predicted company name based on the description
+        """
+
+        comp_type = self.online_comp_types_.get(comp_name,'')
+        if (len(comp_type) == 0) and self.online_patterns.search(comp_name.lower()):
+            comp_type = 'online'
+
+        return comp_type
+
     def google_search(self,comp_name,lat,lng):
         """Google places API request for single company
 
@@ -72,7 +196,7 @@ class company_type():
 
         prefixhtml = 'https://maps.googleapis.com/maps/api/place/textsearch/json?query='
 
-        API_key = 
+        API_key = os.environ.get('GOOGLE_PLACES_API_KEY','')
         descrip = comp_name.replace(' ','+')
         lat = str(lat)
         lng = str(lng)
@@ -80,8 +204,10 @@ class company_type():
         query =('%s&location=%s,%s&radius=%s&key=%s') % (descrip,lat,lng,radius,API_key)
 
         url = prefixhtml + query
-        page = urllib.urlopen(url)
-        data = page.read()
+        self.profiler.count('places_api_calls')
+        with self.profiler.stage('http_places'):
+            page = urllib.urlopen(url)
+            data = page.read()
         js = json.loads(data)
         try:
             goog_details = js['results']
@@ -94,10 +220,13 @@ class company_type():
         """Module returns the company type given the company name and location
 
         The module checks if the company name is in the defined company
-        name table, if it is not then a the google_search function is run
+        name table, then if it is an online company (see online_check), if
+        it is neither then a the google_search function is run
         in order to construct a search query using google api, to find the
         comapany type by sending the location of the user the day of the
-        transaction.
+        transaction.  Each online company resolved locally is counted in
+        api_calls_saved_.  A subscription candidate (see online_companies)
+        google finds nothing for is returned as a subscription.
 
         Parameters
         ----------
@@ -123,11 +252,20 @@ class company_type():
                 if company in comp_name:
                     comp_type = tags[1]
 
+            # online companies have no location to search for
+            if len(comp_type) == 0:
+                comp_type = self.online_check(comp_name)
+                if len(comp_type) > 0:
+                    self.api_calls_saved_ += 1
+                    self.profiler.count('places_api_calls_saved')
+
             goog_details = [comp_type]
 
             # if not part of the  company list, then use google api
             if len(comp_type) == 0:
                 goog_details=self.google_search(comp_name,lat,lng)
+                if (len(goog_details) == 0) and (comp_name in self.subscriptions_):
+                    goog_details = ['subscription']
 
         return goog_details
 
@@ -145,66 +283,172 @@ class company_type():
         of the transaction and calculates the distance between those locations
         and the locations of the companies given by the google search query.
 
-        Then once the distance between every location visited on a given day
-        and the list of possible matching locations is evaluataed, the entry
-        with the smallest distance is chosen as the company that the transaction
-        took place at.
+        Each possible company is then scored on its distance to the closest
+        visited location and on how similar its name is to the predicted
+        company name (see candidate_scores), the entry with the highest score
+        is chosen as the company that the transaction took place at.
+
+        Online companies are resolved without a google query, the number
+        of queries avoided in the run is left in api_calls_saved_.
         """
 
+        self.api_calls_saved_ = 0
+        self.online_companies()
+
         sql_st = '''
             SELECT *
             FROM geo_expense_data
         '''
-        cur = self.conn.cursor()
-        geo_comp_data = cur.execute(sql_st).fetchall()
+        with self.profiler.stage('sql_read'):
+            cur = self.conn.cursor()
+            geo_comp_data = cur.execute(sql_st).fetchall()
 
         for record in geo_comp_data:
-            geo_expense_id = record[0]
-            year = record[2]
-            month = record[3]
-            day = record[4]
-            comp_name = record[5]
-            country = record[6]
-            city = record[7]
-            state = record[9]
-            lat = record[11]
-            lng = record[12]
-            goog_details = self.company_type(comp_name,lat,lng)
-
-            locations = self.locations_visited(year,month,day)
-            # Find distance matrix between locations and visited places
-            # Generate matrix n_location by n_goog_records
-            # Should probably look to add some heuristic for name match
-            if len(goog_details) == 0:
-                sql_record = (geo_expense_id,'','','','','','')
-            elif type(goog_details[0]) == dict:
-                dist_array = np.zeros((len(locations),len(goog_details)))
-                for i in range(len(locations)):
-                    loc_lat = locations[i][0]
-                    loc_lng = locations[i][1]
-                    for j in range(len(goog_details)):
-                        goog_lat = goog_details[j]['geometry']['location']['lat']
-                        goog_lng = goog_details[j]['geometry']['location']['lng']
-
-                        dist_array[i,j] = self.distance(goog_lat,goog_lng,loc_lat,loc_lng)
-
-                min_dist_idx = np.argmin(dist_array)
-                m = min_dist_idx // dist_array.shape[1]
-                n = min_dist_idx - dist_array.shape[1] * m
-                comp_type = goog_details[n]['types'][0]
-                goog_name = goog_details[n]['name']
-                address = goog_details[n]['formatted_address']
-                placeid = goog_details[n]['place_id']
-                goog_lat = goog_details[n]['geometry']['location']['lat']
-                goog_lng = goog_details[n]['geometry']['location']['lng']
-
-                sql_record = (geo_expense_id,goog_name,comp_type,address,placeid,goog_lat,goog_lng)
-            else:
-                comp_type = goog_details[0]
-                sql_record = (geo_expense_id,'',comp_type,'','','','')
-
+            sql_record = self.record_resolver(record)
             self.data_writer(sql_record)
 
+    def record_resolver(self,record):
+        """Finds the company type and location for a single transaction
+
+        Parameters
+        ----------
+        record : tuple
+            Row of the geo_expense_data table
+
+        Attributes
+        ----------
+        sql_record : tuple
+            Contains the data to be written to table exp_comp_type
+        """
+
+        geo_expense_id = record[0]
+        year = record[2]
+        month = record[3]
+        day = record[4]
+        comp_name = record[5]
+        lat = record[11]
+        lng = record[12]
+        goog_details = self.company_type(comp_name,lat,lng)
+
+        # Rank google results on distance to the visited places and
+        # on similarity of their name to the predicted company name
+        if len(goog_details) == 0:
+            sql_record = (geo_expense_id,'','','','','','')
+        elif type(goog_details[0]) == dict:
+            locations = self.day_locations(year,month,day)
+            scores = self.candidate_scores(comp_name,goog_details,locations)
+            n = int(np.argmax(scores))
+            comp_type = goog_details[n]['types'][0]
+            goog_name = goog_details[n]['name']
+            address = goog_details[n]['formatted_address']
+            placeid = goog_details[n]['place_id']
+            goog_lat = goog_details[n]['geometry']['location']['lat']
+            goog_lng = goog_details[n]['geometry']['location']['lng']
+
+            sql_record = (geo_expense_id,goog_name,comp_type,address,placeid,goog_lat,goog_lng)
+        else:
+            comp_type = goog_details[0]
+            sql_record = (geo_expense_id,'',comp_type,'','','','')
+
+        self.profiler.count('transactions_processed')
+        return sql_record
+
+    def unprocessed_records(self,page_size=1000):
+        """Generator over the transactions not yet in exp_comp_type
+
+        Pages through geo_expense_data ordered by date, keeping only the
+        rows without a result in exp_comp_type.  Each page starts after the
+        last (yr, mnth, dy, id) seen rather than at an offset, so rows
+        written while iterating do not shift the pages, and only one page
+        is held in memory at a time.  Missing dates are ordered as 0, a
+        NULL in the key would otherwise never compare as greater.  As finished rows drop out of the
+        query, a run stopped part way through resumes where it left off.
+
+        Parameters
+        ----------
+        page_size : int
+            Number of rows fetched per query.
+        """
+
+        sql_st = '''
+            SELECT geo_expense_data.*
+            FROM geo_expense_data
+            LEFT JOIN exp_comp_type ON geo_expense_data.id = exp_comp_type.geo_expense_id
+            WHERE exp_comp_type.geo_expense_id IS NULL
+                {}
+            ORDER BY IFNULL(geo_expense_data.yr,0), IFNULL(geo_expense_data.mnth,0),
+                IFNULL(geo_expense_data.dy,0), geo_expense_data.id
+            LIMIT ?
+        '''
+        sql_first = sql_st.format('')
+        sql_next = sql_st.format('''AND (IFNULL(geo_expense_data.yr,0), IFNULL(geo_expense_data.mnth,0),
+                    IFNULL(geo_expense_data.dy,0), geo_expense_data.id) > (?,?,?,?)''')
+
+        last_key = None
+        while True:
+            with self.profiler.stage('sql_read'):
+                cur = self.conn.cursor()
+                if last_key is None:
+                    page = cur.execute(sql_first,(page_size,)).fetchall()
+                else:
+                    page = cur.execute(sql_next,last_key + (page_size,)).fetchall()
+            if len(page) == 0:
+                break
+            for record in page:
+                yield record
+            last = page[-1]
+            last_key = tuple(0 if value is None else value
+                             for value in (last[2],last[3],last[4])) + (last[0],)
+
+    def data_stream(self,page_size=1000,batch_size=100):
+        """Streaming version of data_retriever
+
+        Only the transactions missing from exp_comp_type are read, a page
+        at a time in date order (see unprocessed_records), so memory does
+        not grow with the table and the locations of a day are loaded once
+        for consecutive transactions.  Results are written to exp_comp_type
+        in batches, each committed, so a crashed run can simply be launched
+        again.
+
+        Parameters
+        ----------
+        page_size : int
+            Number of transactions read per query.
+        batch_size : int
+            Number of results written per commit.
+        """
+
+        self.api_calls_saved_ = 0
+        self.online_companies()
+
+        records = self.unprocessed_records(page_size)
+        sql_records = (self.record_resolver(record) for record in records)
+
+        batch = []
+        for sql_record in sql_records:
+            batch.append(sql_record)
+            if len(batch) >= batch_size:
+                self.data_writer_batch(batch)
+                batch = []
+        if len(batch) > 0:
+            self.data_writer_batch(batch)
+
+    def day_locations(self,year,month,day):
+        """Cached locations_visited for the last day requested
+
+        Consecutive transactions on the same day reuse the locations
+        already loaded instead of querying goog_locations again.
+        """
+
+        key = (year,month,day)
+        if self._day_locations[0] == key:
+            self.profiler.cache_hit('day_locations')
+        else:
+            self.profiler.cache_miss('day_locations')
+            self._day_locations = (key,self.locations_visited(year,month,day))
+
+        return self._day_locations[1]
+
     def locations_visited(self,year,month,day):
         """Returns the latitude and longitude for a user on a given day
 
@@ -234,39 +478,140 @@ class company_type():
                 (goog_locations.dy = ?)
         '''
 
-        cur = self.conn.cursor()
-        locations = cur.execute(sql_st,(year,month,day)).fetchall()
+        with self.profiler.stage('sql_read'):
+            cur = self.conn.cursor()
+            locations = cur.execute(sql_st,(year,month,day)).fetchall()
 
         return locations
 
-    def distance(self,goog_lat,goog_lng,loc_lat,loc_lng):
-        """Calculates euclidean distance based on two coordinate positions
+    def great_circle(self,goog_lat,goog_lng,loc_lat,loc_lng):
+        """Great circle distance matrix between companies and visited places
 
-        Calculates the distance between the two sets of latitudes and
-        longitudes.
+        Haversine distance computed on arrays, every company against every
+        visited location in one go.
 
         Parameters
         ----------
-        goog_lat : string
-            Latitude for a company from google search query results
-        goog_lng : float
-            Longitude for a company from google search query results
-        loc_lat : float
-            Latitude for a user visited location
-        loc_lng : float
-            Longitude for a user visited location
+        goog_lat : array
+            Latitudes of the companies from the google search query results
+        goog_lng : array
+            Longitudes of the companies from the google search query results
+        loc_lat : array
+            Latitudes of the user visited locations
+        loc_lng : array
+            Longitudes of the user visited locations
 
         Attributes
         ----------
-        distance : float
-            Distance between the two coordinates
+        distance : array
+            n_location by n_goog_records matrix of distances in km
         """
-        d_lat = goog_lat - loc_lat
-        d_lng = goog_lng - loc_lng
-        distance = (np.sqrt(d_lat**2+d_lng**2))
+        goog_lat = np.radians(np.asarray(goog_lat,dtype=float))[np.newaxis,:]
+        goog_lng = np.radians(np.asarray(goog_lng,dtype=float))[np.newaxis,:]
+        loc_lat = np.radians(np.asarray(loc_lat,dtype=float))[:,np.newaxis]
+        loc_lng = np.radians(np.asarray(loc_lng,dtype=float))[:,np.newaxis]
+
+        a = (np.sin((goog_lat - loc_lat)/2)**2 +
+            np.cos(loc_lat)*np.cos(goog_lat)*np.sin((goog_lng - loc_lng)/2)**2)
+        distance = 2*self.earth_radius*np.arcsin(np.sqrt(np.clip(a,0,1)))
 
         return distance
 
+    def name_similarity(self,comp_name,goog_names):
+        """Similarity between the predicted company name and google results
+
+        Two measures are combined, each between 0 and 1:
+        - Token set similarity, the share of the tokens of the shorter name
+        found in the other name.
+        - Phonetic similarity, the same measure on the double metaphone
+        codes of the tokens, so AMZ and Amazon still match.
+        The tokens of all names are one hot encoded on a shared vocabulary
+        so the overlaps for every candidate come from one matrix product.
+
+        Parameters
+        ----------
+        comp_name : string
+            Predicted company name based on the description
+        goog_names : list
+            Names of the companies returned by the google search query
+
+        Attributes
+        ----------
+        similarity : array
+            Name similarity for each google result
+        """
+        dmetaphone = fuzzy.DMetaphone(3)
+
+        def phonetics(tokens):
+            codes = set()
+            for token in tokens:
+                phon = dmetaphone(token)
+                codes.add(phon[0] if phon[0] != None else phon[1])
+            codes.discard(None)
+            return codes
+
+        query_tokens = set(re.findall(r'[\w0-9&]+',comp_name.lower()))
+        goog_tokens = [set(re.findall(r'[\w0-9&]+',name.lower())) for name in goog_names]
+
+        def overlap(query,candidates):
+            vocab = {}
+            for term in query.union(*candidates):
+                vocab.setdefault(term,len(vocab))
+            cand_matrix = np.zeros((len(candidates),len(vocab)))
+            for i,terms in enumerate(candidates):
+                cand_matrix[i,[vocab[t] for t in terms]] = 1
+            query_vec = np.zeros(len(vocab))
+            query_vec[[vocab[t] for t in query]] = 1
+            shared = cand_matrix.dot(query_vec)
+            smallest = np.minimum(cand_matrix.sum(axis=1),query_vec.sum())
+            return np.where(smallest > 0,shared/np.maximum(smallest,1),0.0)
+
+        with self.profiler.stage('name_similarity'):
+            token_sim = overlap(query_tokens,goog_tokens)
+            phon_sim = overlap(phonetics(query_tokens),[phonetics(t) for t in goog_tokens])
+            similarity = (token_sim + phon_sim)/2
+
+        return similarity
+
+    def candidate_scores(self,comp_name,goog_details,locations):
+        """Scores every google result on distance and name similarity
+
+        The distance score decays exponentially with the great circle
+        distance between the company and the closest location visited on
+        the day, dist_scale setting the decay.  When no locations were
+        recorded for the day only the name similarity counts.  Both scores
+        lie between 0 and 1 and are combined with dist_weight and
+        name_weight.
+
+        Parameters
+        ----------
+        comp_name : string
+            Predicted company name based on the description
+        goog_details : list
+            Results from the google search query
+        locations : list
+            Tuples of latitude and longitude visited on the day
+
+        Attributes
+        ----------
+        scores : array
+            Combined score for each google result
+        """
+        goog_lat = [g['geometry']['location']['lat'] for g in goog_details]
+        goog_lng = [g['geometry']['location']['lng'] for g in goog_details]
+
+        if len(locations) > 0:
+            with self.profiler.stage('distance_matrix'):
+                loc = np.asarray(locations,dtype=float)
+                dist_array = self.great_circle(goog_lat,goog_lng,loc[:,0],loc[:,1])
+                dist_score = np.exp(-dist_array.min(axis=0)/self.dist_scale)
+        else:
+            dist_score = np.zeros(len(goog_details))
+
+        name_score = self.name_similarity(comp_name,[g['name'] for g in goog_details])
+        scores = self.dist_weight*dist_score + self.name_weight*name_score
+
+        return scores
 
     def data_writer(self,sql_record):
         """Helper function to write to SQL table exp_comp_type
@@ -285,40 +630,128 @@ class company_type():
             INSERT OR IGNORE INTO exp_comp_type(geo_expense_id,goog_name,comp_type,address,placeid,goog_lat,goog_lng)
             VALUES (?,?,?,?,?,?,?)
         '''
-        cur = self.conn.cursor()
-        cur.execute(sql_st,sql_record)
-        self.conn.commit()
+        with self.profiler.stage('sql_write'):
+            cur = self.conn.cursor()
+            cur.execute(sql_st,sql_record)
+            self.conn.commit()
 
-    def exp_type_loc_table(self):
-        """Aggregates SQL tables containing company type and transaction
+    def data_writer_batch(self,sql_records):
+        """Writes a batch of results to table exp_comp_type in one commit
 
-        Insert & Join SQL statement, creating table exp_type_loc
-        which contains the transaction data and predicted company name
-        and company type.
+        Parameter
+        ---------
+
+        sql_records : list
+            Tuples of the data to be written to table exp_comp_type
         """
 
         sql_st = '''
-            INSERT INTO exp_type_loc(yr, mnth, dy, general_name,goog_name, comp_type, country, city, state, postcode, lat,lng,goog_lat,goog_lng, value)
-                SELECT yr, mnth, dy, general_name, goog_name, comp_type, country, city, state, postcode, lat,lng,goog_lat,goog_lng, value
-                FROM geo_expense_data
-                LEFT JOIN exp_comp_type ON geo_expense_data.id = exp_comp_type.geo_expense_id
+            INSERT OR IGNORE INTO exp_comp_type(geo_expense_id,goog_name,comp_type,address,placeid,goog_lat,goog_lng)
+            VALUES (?,?,?,?,?,?,?)
         '''
+        with self.profiler.stage('sql_write'):
+            cur = self.conn.cursor()
+            cur.executemany(sql_st,sql_records)
+            self.conn.commit()
+
+    def exp_type_loc_key(self):
+        """Adds the geo_expense_id column to exp_type_loc if missing
+
+        The column is given a unique index, so a transaction can only be
+        inserted once into exp_type_loc.  Rows without a geo_expense_id,
+        inserted before the column existed or by the full mode, are
+        deleted, exp_type_loc_table(only_new=True) then inserts them again
+        with their geo_expense_id.  Nothing is committed, so the caller
+        deletes and inserts them in one transaction.
+
+        Attributes
+        ----------
+        n_deleted : int
+            Number of rows without a geo_expense_id deleted.
+        """
 
         cur = self.conn.cursor()
-        cur.execute(sql_st)
-        self.conn.commit()
+        columns = [row[1] for row in cur.execute('PRAGMA table_info(exp_type_loc)')]
+        if 'geo_expense_id' not in columns:
+            cur.execute('ALTER TABLE exp_type_loc ADD COLUMN geo_expense_id INTEGER')
+        cur.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS exp_type_loc_geo_expense_id
+            ON exp_type_loc(geo_expense_id)
+        ''')
+
+        with self.profiler.stage('sql_write'):
+            cur.execute('DELETE FROM exp_type_loc WHERE geo_expense_id IS NULL')
+        return cur.rowcount
+
+    def exp_type_loc_table(self,only_new=False):
+        """Aggregates SQL tables containing company type and transaction
+
+        Insert & Join SQL statement, creating table exp_type_loc
+        which contains the transaction data and predicted company name
+        and company type.  If a spend_rollup was given the inserted rows
+        are added to it in the same transaction, the rollups being rebuilt
+        if exp_type_loc_key deleted rows.
+
+        Parameters
+        ----------
+        only_new : bool
+            If True only the transactions with a result in exp_comp_type
+            and not yet in exp_type_loc are inserted, keyed on
+            geo_expense_id (see exp_type_loc_key), so the streaming mode
+            can be run repeatedly.  Otherwise every transaction is inserted.
+        """
 
-    def company_info_loader(self):
+        n_deleted = 0
+        if only_new:
+            n_deleted = self.exp_type_loc_key()
+            sql_st = '''
+                INSERT OR IGNORE INTO exp_type_loc(geo_expense_id, yr, mnth, dy, general_name,goog_name, comp_type, country, city, state, postcode, lat,lng,goog_lat,goog_lng, value)
+                    SELECT geo_expense_data.id, yr, mnth, dy, general_name, goog_name, comp_type, country, city, state, postcode, lat,lng,goog_lat,goog_lng, value
+                    FROM geo_expense_data
+                    JOIN exp_comp_type ON geo_expense_data.id = exp_comp_type.geo_expense_id
+            '''
+        else:
+            sql_st = '''
+                INSERT INTO exp_type_loc(yr, mnth, dy, general_name,goog_name, comp_type, country, city, state, postcode, lat,lng,goog_lat,goog_lng, value)
+                    SELECT yr, mnth, dy, general_name, goog_name, comp_type, country, city, state, postcode, lat,lng,goog_lat,goog_lng, value
+                    FROM geo_expense_data
+                    LEFT JOIN exp_comp_type ON geo_expense_data.id = exp_comp_type.geo_expense_id
+            '''
+
+        with self.profiler.stage('sql_write'):
+            cur = self.conn.cursor()
+            cur.execute(sql_st)
+        if (self.rollup is not None) and (n_deleted > 0):
+            self.rollup.rollup_rebuild(commit=False)
+        elif self.rollup is not None:
+            self.rollup.rollup_update(commit=False)
+        with self.profiler.stage('sql_write'):
+            self.conn.commit()
+
+    def company_info_loader(self,page_size=None):
         """Primary aggregation launcher
 
         Script launches data.retriever and exp_type_loc table in order
         to retrieve the company type given a name and then aggregate,
-        company type and location into a table.
-        """
+        company type and location into a table.  The new exp_type_loc
+        rows are then exported if an exporter was given.
 
+        Parameters
+        ----------
+        page_size : int
+            If given the transactions are streamed with data_stream in
+            pages of page_size, only those not already processed, and
+            only those not yet in exp_type_loc are added to it.
+        """
 
-        self.data_retriever()
-        self.exp_type_loc_table()
+        if page_size is None:
+            self.data_retriever()
+            self.exp_type_loc_table()
+        else:
+            self.data_stream(page_size)
+            self.exp_type_loc_table(only_new=True)
+        if self.exporter is not None:
+            self.exporter.export()
 
     def summary_table(self):
         """Creates summary transaction information to display in online table'
@@ -332,6 +765,7 @@ class company_type():
         FROM exp_type_loc
         '''
 
-        cur = self.conn.cursor()
-        cur.execute(sql_st)
-        self.conn.commit()
+        with self.profiler.stage('sql_write'):
+            cur = self.conn.cursor()
+            cur.execute(sql_st)
+            self.conn.commit()
@@ -8,13 +8,32 @@ import sqlite3
 import fuzzy
 import nltk
 import numpy
+from profiler import null_profiler
+from token_store import comp_compare_row, parsed_store
 
 class description_parser():
-    """Provides common code for parsing expenditure description"""
+    """Provides common code for parsing expenditure description
 
-    def __init__(self,conn,last_load_id):
+        Parameters
+        ----------
+        conn : sqlite3 db connection
+            SQLITE database connection
+        last_load_id : int
+            Id of the last load processed
+        profiler : stage_profiler
+            Optional profiler recording timings of each parsing stage,
+            profiling is disabled if not given.
+        store : parsed_store
+            Optional compact store, if given the tags of every parsed
+            description are appended to it.
+    """
+
+    def __init__(self,conn,last_load_id,profiler=None,store=None):
         self.conn = conn
         self.last_load_id = last_load_id
+        self.profiler = profiler if profiler is not None else null_profiler
+        self.store = store
+        self._word_dict = None
 
     def is_company_check(self,comp_descr):
         """Check if company description string passed is just numeric
@@ -37,7 +56,8 @@ class description_parser():
         return num_chk
 
     def word_tokenizer(self, comp_descr):
-        components = re.findall('[\w0-9&]+',comp_descr.lower())
+        with self.profiler.stage('tokenization'):
+            components = re.findall('[\w0-9&]+',comp_descr.lower())
         return components
 
     def comp_word_parser(self,comp_descr,frequency_stats):
@@ -61,6 +81,10 @@ class description_parser():
         - Parts of speech, for the word, this is currently not exploited in the
         word definition but oculd be integrated later.
 
+        The NLTK word list is read on the first call and kept for the life of
+        the parser instead of being rebuilt for every description, the
+        profiler reports it as the word_dict cache.
+
         Parameters
         ----------
         comp_descr : string
@@ -73,38 +97,48 @@ class description_parser():
             [is_word_term,embedded_word, word_struc,prev_count,pos,
             word_phon_count]
         """
+        prof = self.profiler
         tag_comp = {}
-        word_dict = set([i.lower() for i in nltk.corpus.words.words()])
+        if self._word_dict is None:
+            prof.cache_miss('word_dict')
+            with prof.stage('dictionary_load'):
+                self._word_dict = set([i.lower() for i in nltk.corpus.words.words()])
+        else:
+            prof.cache_hit('word_dict')
+        word_dict = self._word_dict
         vowels = set(['a','e','i','o','u','y'])
 
         # Add phonetic term for whole description
         dmetaphone = fuzzy.DMetaphone(3)
-        phon = dmetaphone(comp_descr)
+        with prof.stage('phonetics'):
+            phon = dmetaphone(comp_descr)
 
         # Split company description into tokens
         components = self.word_tokenizer(comp_descr)
         word_comp = dict()
         # Now tag the components
         for each in components:
-            # Check if in dictionary
-            if each in word_dict:
-                is_word_term = 2
-            else:
-                is_word_term = 0
-            # Check if part of word is in dictionary if <3 letters
-            word_len = len(each)
-            embedded_word = False
-            if is_word_term > 0:
-                embedded_word = True
-            elif (word_len > 3):
-                for i in range(3,word_len):
-                    word_part = each[:i]
-                    if word_part in word_dict:
-                        embedded_word = True
-            else:
+            with prof.stage('dictionary_lookup'):
+                # Check if in dictionary
+                if each in word_dict:
+                    is_word_term = 2
+                else:
+                    is_word_term = 0
+                # Check if part of word is in dictionary if <3 letters
+                word_len = len(each)
                 embedded_word = False
+                if is_word_term > 0:
+                    embedded_word = True
+                elif (word_len > 3):
+                    for i in range(3,word_len):
+                        word_part = each[:i]
+                        if word_part in word_dict:
+                            embedded_word = True
+                else:
+                    embedded_word = False
             # Phonetic count
-            phon_word1,phon_word2 = dmetaphone(each)
+            with prof.stage('phonetics'):
+                phon_word1,phon_word2 = dmetaphone(each)
             sound_count1 = 0
             sound_count2 = 0
             if phon_word1 != None:
@@ -142,12 +176,15 @@ class description_parser():
             if len(each) > 5:
                 len_word_points = 1
             # Parts of Speech
-            pos = nltk.pos_tag([each])[0][1]
+            with prof.stage('pos_tagging'):
+                pos = nltk.pos_tag([each])[0][1]
 
             word_comp[each] = [is_word_term,embedded_word, word_struc,prev_count,pos, word_phon_count,len_word_points]
 
         tag_comp[comp_descr] = word_comp
         self.tags_ = tag_comp
+        if self.store is not None:
+            self.store.append(comp_descr,word_comp)
         return tag_comp
 
     def comp_name_score(self,comp_descr,frequency_stats):
@@ -248,7 +285,8 @@ class description_parser():
         detail_dict = {}
         company = self.company_name_full(comp_descr,frequency_stats)
         dmetaphone = fuzzy.DMetaphone(3)
-        phon_match1,phon_match2 = dmetaphone(company)
+        with self.profiler.stage('phonetics'):
+            phon_match1,phon_match2 = dmetaphone(company)
         if len(company) == 0:
             letter_set = set()
             first_letter = ''
@@ -257,6 +295,88 @@ class description_parser():
             first_letter = company[0]
         return (comp_descr,company,phon_match1,phon_match2,first_letter,str(letter_set))
 
+    def parse_stored(self,comp_descr,frequency_stats):
+        """Entry number of a description in the parsed_store
+
+        The description is only parsed if it is not stored yet.  A store is
+        created if the parser was given none.
+        """
+
+        if self.store is None:
+            self.store = parsed_store()
+        idx = self.store.index(comp_descr)
+        if idx is None:
+            self.comp_word_parser(comp_descr,frequency_stats)
+            idx = self.store.index(comp_descr)
+        return idx
+
+    def comp_name_train(self,model,frequency_stats,batch_size=1000):
+        """Fits a name_model on the company names in comp_name_compare
+
+        Only the rows the model was not trained on yet, or whose company
+        name was corrected since, are parsed into the parsed_store (see
+        parse_stored) and fitted with partial_fit, batch_size descriptions
+        at a time.
+
+        Parameters
+        ----------
+        model : name_model
+            Naive Bayes company name model to update.
+        batch_size : int
+            Number of descriptions featurized at once.
+
+        returns model
+        """
+
+        sql_st = """
+        SELECT description, company_lst_name
+        FROM comp_name_compare;
+        """
+        with self.profiler.stage('sql_read'):
+            cur = self.conn.cursor()
+            comp_rows = cur.execute(sql_st).fetchall()
+        comp_rows = [(comp_descr,company) for comp_descr,company in comp_rows
+                     if not model.is_trained(comp_descr,company)]
+        self.profiler.count('name_model_rows_fitted',len(comp_rows))
+
+        for start in range(0,len(comp_rows),batch_size):
+            batch = comp_rows[start:start + batch_size]
+            rows = [self.parse_stored(comp_descr,frequency_stats) for comp_descr,_ in batch]
+            with self.profiler.stage('name_model_fit'):
+                model.partial_fit(self.store,rows,[company for _,company in batch])
+
+        return model
+
+    def company_name_batch(self,company_name_lst,model,frequency_stats,batch_size=1000):
+        """Predicted company names for a list of descriptions with a name_model
+
+        Naive Bayes counterpart of company_name_full, the descriptions are
+        parsed into the parsed_store and predicted batch_size at a time.
+
+        Parameters
+        ----------
+        company_name_lst : list
+            Company descriptions from statement.
+        model : name_model
+            Fitted Naive Bayes company name model.
+        batch_size : int
+            Number of descriptions predicted at once.
+
+        Attributes
+        ----------
+        comp_names : list
+            Predicted company name for each description.
+        """
+
+        comp_names = []
+        for start in range(0,len(company_name_lst),batch_size):
+            rows = [self.parse_stored(comp_descr,frequency_stats)
+                    for comp_descr in company_name_lst[start:start + batch_size]]
+            with self.profiler.stage('name_model_predict'):
+                comp_names.extend(model.predict_batch(self.store,rows))
+
+        return comp_names
+
     def company_insert(self,comp_descr,frequency_stats):
         """Inserts new company with name attributes into SQL table
 
@@ -273,46 +393,45 @@ class description_parser():
             description,company_lst_name,phonetic1,phonetic2,first_letter,set_letters)
             VALUES(?,?,?,?,?,?)
         '''
-        cur = self.conn.cursor()
-        cur.execute(sql_st,company_tags)
-        self.conn.commit()
+        with self.profiler.stage('sql_write'):
+            cur = self.conn.cursor()
+            cur.execute(sql_st,company_tags)
+            self.conn.commit()
 
     def company_name_update(self):
         """To be finished, placeholder for moment"""
 
-        similar_dict = {}
         accro_dict = defaultdict()
         sql_st_fetch = """
         SELECT *
         FROM comp_name_compare;
         """
 
-        cur = self.conn.cursor()
-        comp_param_list = cur.execute(sql_st_fetch).fetchall()
-
-        for i in range(len(comp_param_list)):
-            comp_0 = comp_param_list[i][0]
-            phon_0 = set([comp_param_list[i][2],comp_param_list[i][3]])
-            first_letter_0 = comp_param_list[i][4]
-            letter_set_0 = set(re.findall("\'([a-z0-9])\'",comp_param_list[i][5]))
-            similar_dict[comp_0] = []
+        # Rows are parsed once into slotted records, the letter sets
+        # becoming bit masks so subset checks are integer operations
+        with self.profiler.stage('sql_read'):
+            cur = self.conn.cursor()
+            comp_rows = [comp_compare_row(row[0],row[1],(row[2],row[3]),row[4],row[5])
+                         for row in cur.execute(sql_st_fetch)]
+
+        for i,row_0 in enumerate(comp_rows):
+            comp_0 = row_0.description
+            phon_0 = set(row_0.phonetics)
             accro_dict[comp_0] = []
-            for j in range(len(comp_param_list)):
+            for j,row_1 in enumerate(comp_rows):
                 match_count = 0
                 if j != i:
-                    comp_1 = comp_param_list[j][0]
-                    phon_1 = set([comp_param_list[j][2],comp_param_list[j][3]])
-                    first_letter_1 = comp_param_list[j][4]
-                    letter_set_1 = set(re.findall("\'([a-z0-9])\'",comp_param_list[j][5]))
-                    if len(phon_0 - phon_1) < 2:
+                    comp_1 = row_1.description
+                    phon_diff = len([p for p in phon_0 if p not in row_1.phonetics])
+                    if phon_diff < 2:
                         match_count += 1
-                    if first_letter_0 == first_letter_1:
+                    if row_0.first_letter == row_1.first_letter:
                         match_count += 1
-                    if len(letter_set_0) < len(letter_set_1):
-                        if len(letter_set_0 - letter_set_1) == 0:
+                    if row_0.n_letters < row_1.n_letters:
+                        if row_0.letter_mask & ~row_1.letter_mask == 0:
                             match_count += 1
                     else:
-                        if len(letter_set_1 - letter_set_0) == 0:
+                        if row_1.letter_mask & ~row_0.letter_mask == 0:
                             match_count += 1
                 else:
                     match_count = -1
@@ -320,7 +439,7 @@ class description_parser():
                 if match_count >= 3:
                     accro_dict[comp_0].append(comp_1.lower())
                 elif match_count == -1:
-                    accro_dict[comp_0].append(comp_param_list[i][1].lower())
+                    accro_dict[comp_0].append(row_0.company.lower())
 
         """ Accronym maker """
         accro_transform = {}
@@ -337,9 +456,10 @@ class description_parser():
                 (company_lst_name,general_name)
                 VALUES(?,?)
             '''
-            cur = self.conn.cursor()
-            cur.execute(sql_st,comp_tuple)
-            self.conn.commit()
+            with self.profiler.stage('sql_write'):
+                cur = self.conn.cursor()
+                cur.execute(sql_st,comp_tuple)
+                self.conn.commit()
 
     def frequency_updater(self,comp_descr):
         """Updates database with word occurence frequency
@@ -358,7 +478,8 @@ class description_parser():
         for word in components:
             # Update phonetics table
             dmetaphone = fuzzy.DMetaphone(3)
-            phon = dmetaphone(word)
+            with self.profiler.stage('phonetics'):
+                phon = dmetaphone(word)
             if phon[0] != None:
                 phon = phon[0]
             else:
@@ -382,11 +503,13 @@ class description_parser():
 
             data = (word,0)
             data_phon = (phon,0)
-            cur.execute(sql_st1,data)
-            cur.execute(sql_phon1,data_phon)
-            cur.execute(sql_st2,(word,))
-            cur.execute(sql_phon2,(phon,))
-        self.conn.commit()
+            with self.profiler.stage('sql_write'):
+                cur.execute(sql_st1,data)
+                cur.execute(sql_phon1,data_phon)
+                cur.execute(sql_st2,(word,))
+                cur.execute(sql_phon2,(phon,))
+        with self.profiler.stage('sql_write'):
+            self.conn.commit()
 
     def frequency_retriever(self,word):
         """Retrieves word occurence frequency
@@ -408,7 +531,8 @@ class description_parser():
             WHERE comp_term = ?;
         """
 
-        freq = cur.execute(sql_st,(word,)).fetchall()[0][0]
+        with self.profiler.stage('frequency_query'):
+            freq = cur.execute(sql_st,(word,)).fetchall()[0][0]
         self.freq = freq
         return freq
 
@@ -426,13 +550,14 @@ class description_parser():
         phon_var : real
             variance of phonetic frequency
         """
-        df_phon = pd.read_sql_query('SELECT frequency FROM comp_phon_counts',self.conn)
+        with self.profiler.stage('frequency_stats'):
+            df_phon = pd.read_sql_query('SELECT frequency FROM comp_phon_counts',self.conn)
+            df_word = pd.read_sql_query('SELECT frequency FROM comp_word_counts',self.conn)
         df_phon = pd.to_numeric(df_phon.frequency)
 
         phon_mean = df_phon.mean()
         phon_std = df_phon.std()
 
-        df_word = pd.read_sql_query('SELECT frequency FROM comp_word_counts',self.conn)
         df_word = pd.to_numeric(df_word.frequency)
 
         word_mean = df_word.mean()
@@ -465,7 +590,8 @@ class description_parser():
             WHERE comp_phon = ?;
         """
 
-        freq = cur.execute(sql_st,(phon,)).fetchall()[0][0]
+        with self.profiler.stage('phon_frequency_query'):
+            freq = cur.execute(sql_st,(phon,)).fetchall()[0][0]
         self.freq = freq
         return freq
 
@@ -500,3 +626,4 @@ class description_parser():
             num_chk = self.is_company_check(comp_descr)
             if num_chk:
                 self.company_insert(comp_descr,frequency_stats)
+                self.profiler.count('descriptions_parsed')
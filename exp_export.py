@@ -0,0 +1,212 @@
+import os
+import json
+import glob
+from collections import defaultdict
+import pyarrow as pa
+import pyarrow.parquet as pq
+from profiler import null_profiler
+
+class exp_type_loc_export():
+    """Columnar export of the exp_type_loc table for analytics
+
+    Writes the enriched transactions of exp_type_loc to Parquet or Arrow
+    IPC files partitioned by year and month (export_dir/yr=2017/mnth=3/),
+    so analysis and the dashboard can read them without touching the
+    SQLite database the loader writes to.  Only the rows added since the
+    last export are written, each export adding new part files named
+    after the first rowid they hold.
+
+        Parameters
+        ----------
+        conn : sqlite3 db connection
+            SQLITE database connection, only needed to export.
+        export_dir : string
+            Directory the partitioned files are written to.
+        file_format : string
+            'parquet' or 'arrow' (Arrow IPC, read without any decoding).
+        page_size : int
+            Number of rows read from exp_type_loc per query.
+        profiler : stage_profiler
+            Optional profiler recording timings of the export stages,
+            profiling is disabled if not given.
+    """
+
+    schema = pa.schema([
+        ('yr',pa.int32()),('mnth',pa.int32()),('dy',pa.int32()),
+        ('general_name',pa.string()),('goog_name',pa.string()),('comp_type',pa.string()),
+        ('country',pa.string()),('city',pa.string()),('state',pa.string()),('postcode',pa.string()),
+        ('lat',pa.float64()),('lng',pa.float64()),
+        ('goog_lat',pa.float64()),('goog_lng',pa.float64()),
+        ('value',pa.float64())])
+    extensions = {'parquet':'.parquet','arrow':'.arrow'}
+    state_file = '_export_state.json'
+
+    def __init__(self,conn,export_dir,file_format='parquet',page_size=50000,profiler=None):
+        if file_format not in self.extensions:
+            raise ValueError('Unknown export format: %s' % file_format)
+        self.conn = conn
+        self.export_dir = export_dir
+        self.file_format = file_format
+        self.page_size = page_size
+        self.profiler = profiler if profiler is not None else null_profiler
+
+    def last_exported(self):
+        """Returns the last exp_type_loc rowid exported, 0 if none"""
+
+        path = os.path.join(self.export_dir,self.state_file)
+        if not os.path.exists(path):
+            return 0
+        with open(path) as f:
+            return json.load(f)['last_rowid']
+
+    def _record_exported(self,last_rowid):
+        path = os.path.join(self.export_dir,self.state_file)
+        with open(path + '.tmp','w') as f:
+            json.dump({'last_rowid':last_rowid},f)
+        os.replace(path + '.tmp',path)
+
+    @staticmethod
+    def _number(value,convert):
+        # exp_comp_type holds '' where no google result was found, SQLite
+        # may also hand back numbers stored as text
+        if value is None or value == '':
+            return None
+        try:
+            return convert(value)
+        except (TypeError,ValueError):
+            return None
+
+    @staticmethod
+    def _integer(value):
+        if not isinstance(value,float):
+            try:
+                return int(value)
+            except ValueError:
+                pass
+        number = float(value)
+        if not number.is_integer():
+            raise ValueError('Not an integer: %r' % value)
+        return int(number)
+
+    def _column_values(self,rows,idx,field):
+        values = [row[idx] for row in rows]
+        if pa.types.is_floating(field.type):
+            values = [self._number(v,float) for v in values]
+        elif pa.types.is_integer(field.type):
+            values = [self._number(v,self._integer) for v in values]
+        elif pa.types.is_string(field.type):
+            values = [None if v is None else str(v) for v in values]
+        return values
+
+    def _write_partition(self,yr,mnth,rows):
+        columns = [self._column_values(rows,i + 1,field) for i,field in enumerate(self.schema)]
+        table = pa.Table.from_arrays([pa.array(c,type=f.type) for c,f in zip(columns,self.schema)],
+                                     schema=self.schema)
+
+        part_dir = os.path.join(self.export_dir,'yr=%s' % yr,'mnth=%s' % mnth)
+        if not os.path.isdir(part_dir):
+            os.makedirs(part_dir)
+        name = 'part-%d%s' % (rows[0][0],self.extensions[self.file_format])
+        path = os.path.join(part_dir,name)
+
+        # Written next to the target and moved in place, so neither read
+        # nor a resumed export ever sees a half written file
+        with self.profiler.stage('export_write'):
+            if self.file_format == 'parquet':
+                pq.write_table(table,path + '.tmp')
+            else:
+                with pa.OSFile(path + '.tmp','wb') as sink:
+                    with pa.ipc.new_file(sink,self.schema) as writer:
+                        writer.write_table(table)
+            os.replace(path + '.tmp',path)
+
+    def export(self):
+        """Appends the exp_type_loc rows added since the last export
+
+        The new rows are read a page at a time in rowid order, split by
+        year and month and written as one file per partition and page,
+        named after the first rowid of the partition in the page.  The
+        last rowid written is recorded once all files of a page are in
+        place.  An export stopped part way through a page carries on from
+        the last recorded rowid, the first row of each partition being the
+        same, its files are overwritten rather than duplicated.
+
+        Attributes
+        ----------
+        n_rows : int
+            Number of rows exported.
+        """
+
+        sql_st = '''
+            SELECT rowid, %s
+            FROM exp_type_loc
+            WHERE rowid > ?
+            ORDER BY rowid
+            LIMIT ?
+        ''' % ', '.join(self.schema.names)
+
+        if not os.path.isdir(self.export_dir):
+            os.makedirs(self.export_dir)
+        last_rowid = self.last_exported()
+        n_rows = 0
+        while True:
+            with self.profiler.stage('sql_read'):
+                cur = self.conn.cursor()
+                rows = cur.execute(sql_st,(last_rowid,self.page_size)).fetchall()
+            if len(rows) == 0:
+                break
+
+            partitions = defaultdict(list)
+            for row in rows:
+                partitions[(row[1],row[2])].append(row)
+            for (yr,mnth),part_rows in partitions.items():
+                self._write_partition(yr,mnth,part_rows)
+
+            last_rowid = rows[-1][0]
+            n_rows += len(rows)
+            self._record_exported(last_rowid)
+
+        self.profiler.count('rows_exported',n_rows)
+        return n_rows
+
+    def read(self,columns=None,yr=None,mnth=None):
+        """Reads the exported transactions
+
+        Only the partitions matching yr and mnth are opened and only the
+        requested columns are read.  Files are memory mapped, Arrow IPC
+        files being used in place without copying.
+
+        Parameters
+        ----------
+        columns : list
+            Columns to read, all if not given.
+        yr : int
+            Only read this year.
+        mnth : int
+            Only read this month.
+
+        Attributes
+        ----------
+        table : pyarrow.Table
+            The exported transactions.
+        """
+
+        pattern = os.path.join(self.export_dir,
+                               'yr=%s' % ('*' if yr is None else yr),
+                               'mnth=%s' % ('*' if mnth is None else mnth),
+                               '*' + self.extensions[self.file_format])
+        schema = self.schema if columns is None else pa.schema([self.schema.field(c) for c in columns])
+
+        tables = []
+        with self.profiler.stage('export_read'):
+            for path in sorted(glob.glob(pattern)):
+                if self.file_format == 'parquet':
+                    tables.append(pq.read_table(path,columns=schema.names,memory_map=True))
+                else:
+                    table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+                    tables.append(table.select(schema.names))
+            if len(tables) == 0:
+                return schema.empty_table()
+            table = pa.concat_tables(tables)
+
+        return table
@@ -0,0 +1,403 @@
+import zlib
+from array import array
+import numpy as np
+
+class name_model():
+    """Naive Bayes model of which description tokens form the company name
+
+    Replaces the fixed points of comp_name_score with learnt weights.  Each
+    token is described by sparse features built from the tags of
+    description_parser.comp_word_parser (dictionary word, embedded word,
+    word structure, frequency, phonetic frequency, length, parts of
+    speech) plus its character n-grams.  The features are hashed into
+    n_features buckets, so no vocabulary has to be kept and unseen tokens
+    still get a prediction.  A multinomial Naive Bayes with two classes
+    (part of the name or not) is then fitted incrementally.  The model
+    remembers the descriptions it was trained on, with their company name
+    and the features and labels of their tokens, so fitting the same rows
+    again is skipped and a corrected company name replaces the counts of
+    the old one instead of adding to them.
+
+        Parameters
+        ----------
+        n_features : int
+            Number of hash buckets for the features.
+        alpha : float
+            Additive (Laplace) smoothing of the feature counts.
+        ngram : int
+            Length of the character n-grams.
+
+        Attributes
+        ----------
+        trained_ : dict
+            For each trained description, its company name and the range of
+            its tokens in the trained token arrays.
+    """
+
+    accepted_parts = ('&','and','the')
+
+    def __init__(self,n_features=2**18,alpha=1.0,ngram=3):
+        self.n_features = n_features
+        self.alpha = alpha
+        self.ngram = ngram
+        self.class_count_ = np.zeros(2)
+        self.feature_count_ = np.zeros((2,n_features))
+        self._reset_caches()
+        self._reset_trained()
+        self._update_log_prob()
+
+    def _reset_caches(self):
+        self._hash_cache = {}
+        # n-gram and parts of speech buckets of each vocabulary id of the
+        # last store featurized, in CSR layout for the n-grams
+        self._vocab = None
+        self._ngram_indptr = array('q',[0])
+        self._ngram_indices = array('i')
+        self._pos_vocab = None
+        self._pos_buckets = array('i')
+
+    def _reset_trained(self):
+        self.trained_ = {}
+        self._trained_labels = array('b')
+        self._trained_indptr = array('q',[0])
+        self._trained_indices = array('i')
+        self._trained_dead = 0
+
+    def _hash(self,name):
+        bucket = self._hash_cache.get(name)
+        if bucket is None:
+            bucket = zlib.crc32(name.encode('utf-8')) % self.n_features
+            self._hash_cache[name] = bucket
+        return bucket
+
+    @staticmethod
+    def _ranges(starts,lengths):
+        # Concatenated np.arange(start,start + length) for each pair
+        ends = np.cumsum(lengths)
+        return np.repeat(starts - ends + lengths,lengths) + np.arange(ends[-1] if len(ends) else 0)
+
+    def _vocab_buckets(self,store):
+        """Extends the n-gram and parts of speech buckets to new vocabulary ids
+
+        The vocabularies of a store only grow, so only the ids added since
+        the last call are hashed.  Another store starts the caches over.
+        """
+        if self._vocab is not store.vocab:
+            self._vocab = store.vocab
+            self._ngram_indptr = array('q',[0])
+            self._ngram_indices = array('i')
+        for token_id in range(len(self._ngram_indptr) - 1,len(store.vocab)):
+            padded = '^%s$' % store.vocab.token(token_id)
+            self._ngram_indices.extend(self._hash('ng=%s' % padded[i:i + self.ngram])
+                                       for i in range(max(len(padded) - self.ngram + 1,1)))
+            self._ngram_indptr.append(len(self._ngram_indices))
+
+        if self._pos_vocab is not store.pos_vocab:
+            self._pos_vocab = store.pos_vocab
+            self._pos_buckets = array('i')
+        for pos_id in range(len(self._pos_buckets),len(store.pos_vocab)):
+            self._pos_buckets.append(self._hash('pos=%s' % store.pos_vocab.token(pos_id)))
+
+    def _tag_buckets(self,tags,pos_ids):
+        """Hash buckets of the tag features, one column per feature
+
+        The numeric tags (in the order of parsed_store.feature_names) are
+        turned into feature values for all tokens at once, the frequency
+        bins being the floor clipped to 0..5 and -2..5, NaN (i.e.
+        frequency_stats with no variance) falling in bin 0.
+        """
+        def binned(values,low,high):
+            values = np.nan_to_num(np.floor(values),nan=0.0)
+            return np.clip(values,low,high).astype(np.int64) - low
+
+        def buckets(name,values,low):
+            return np.array([self._hash('%s=%d' % (name,low + v)) for v in range(values.max() + 1)],
+                            dtype=np.int64)[values]
+
+        lens = tags[:,5].astype(np.int64)
+        lens_unique,lens_idx = np.unique(lens,return_inverse=True)
+        lens_buckets = np.array([self._hash('len=%d' % v) for v in lens_unique],dtype=np.int64)
+
+        return np.column_stack([
+            buckets('dict',(tags[:,0] > 0).astype(np.int64),0),
+            buckets('emb',(tags[:,1] != 0).astype(np.int64),0),
+            buckets('struc',(tags[:,2] != 0).astype(np.int64),0),
+            buckets('freq',binned(tags[:,3],0,5),0),
+            buckets('phon',binned(tags[:,4],-2,5),-2),
+            lens_buckets[lens_idx.reshape(-1)],
+            np.frombuffer(self._pos_buckets,dtype=np.int32)[pos_ids]])
+
+    def featurize(self,store,rows):
+        """Sparse feature matrix for the tokens of stored descriptions
+
+        The tokens are gathered from the flat arrays of the parsed_store
+        with numpy and all their tag features computed in one pass.  The
+        character n-gram buckets of each vocabulary id are hashed once and
+        then gathered the same way.
+
+        Parameters
+        ----------
+        store : parsed_store
+            Store holding the parsed descriptions.
+        rows : list
+            Entry numbers of the descriptions in the store.
+
+        Attributes
+        ----------
+        indices : array
+            Feature buckets of every token, one token after the other.
+        indptr : array
+            Start of each token in indices (CSR layout), n_tokens + 1 long.
+        token_rows : array
+            Position in rows of the description of each token.
+        token_ids : array
+            Vocabulary id of each token.
+        """
+        self._vocab_buckets(store)
+        # Views on the store arrays, only the gathered tokens are copied
+        rows = np.asarray(rows,dtype=np.int64)
+        offsets = np.frombuffer(store.offsets,dtype=np.int64)
+        n_tokens = offsets[rows + 1] - offsets[rows]
+        positions = self._ranges(offsets[rows],n_tokens)
+        token_rows = np.repeat(np.arange(len(rows)),n_tokens)
+        if len(positions) == 0:
+            empty = np.zeros(0,dtype=np.int64)
+            return empty,np.zeros(1,dtype=np.int64),empty,empty
+
+        n_tags = len(store.feature_names)
+        tags = np.frombuffer(store.features,dtype=np.float32).reshape(-1,n_tags)[positions]
+        token_ids = np.frombuffer(store.token_ids,dtype=np.int32)[positions].astype(np.int64)
+        pos_ids = np.frombuffer(store.pos_ids,dtype=np.int32)[positions]
+
+        tag_buckets = self._tag_buckets(tags,pos_ids)
+        ngram_indptr = np.frombuffer(self._ngram_indptr,dtype=np.int64)
+        n_ngrams = ngram_indptr[token_ids + 1] - ngram_indptr[token_ids]
+        ngram_buckets = np.frombuffer(self._ngram_indices,dtype=np.int32)[
+            self._ranges(ngram_indptr[token_ids],n_ngrams)]
+
+        # Each token holds its tag buckets followed by its n-gram buckets
+        n_tag_features = tag_buckets.shape[1]
+        indptr = np.concatenate(([0],np.cumsum(n_tag_features + n_ngrams)))
+        indices = np.empty(indptr[-1],dtype=np.int64)
+        indices[(indptr[:-1,np.newaxis] + np.arange(n_tag_features)).reshape(-1)] = tag_buckets.reshape(-1)
+        indices[self._ranges(indptr[:-1] + n_tag_features,n_ngrams)] = ngram_buckets
+
+        return indices,indptr,token_rows,token_ids
+
+    def token_labels(self,store,token_rows,token_ids,companies):
+        """1 for each token found in the company name of its description"""
+        # (description, token id) pairs keyed as one int to match them at once
+        n_vocab = len(store.vocab)
+        name_keys = [r*n_vocab + store.vocab.ids_[word]
+                     for r,company in enumerate(companies)
+                     for word in str(company).lower().split() if word in store.vocab.ids_]
+        return np.isin(token_rows*n_vocab + token_ids,name_keys).astype(np.int64)
+
+    def _feature_counts(self,labels,indptr,indices):
+        # Count of each feature bucket for each class, as feature_count_
+        token_labels = np.repeat(labels,np.diff(indptr))
+        counts = np.bincount(token_labels*self.n_features + indices,minlength=2*self.n_features)
+        return counts.reshape(2,self.n_features)
+
+    def is_trained(self,comp_descr,company):
+        """True if comp_descr was already fitted with this company name"""
+        trained = self.trained_.get(comp_descr)
+        return trained is not None and trained[0] == str(company)
+
+    def _forget(self,comp_descr):
+        # Removes the counts added when comp_descr was fitted, using the
+        # labels it had then
+        company,token_start,token_end = self.trained_.pop(comp_descr)
+        self._trained_dead += token_end - token_start
+        labels = np.frombuffer(self._trained_labels,dtype=np.int8)[token_start:token_end].astype(np.int64)
+        indptr = np.frombuffer(self._trained_indptr,dtype=np.int64)[token_start:token_end + 1]
+        indices = np.frombuffer(self._trained_indices,dtype=np.int32)[indptr[0]:indptr[-1]]
+        self.feature_count_ -= self._feature_counts(labels,indptr,indices)
+        self.class_count_ -= np.bincount(labels,minlength=2)
+
+    def _compact(self):
+        """Drops the tokens of forgotten descriptions from the trained arrays
+
+        The token ranges of the trained descriptions are gathered in one
+        pass and moved to the front, keeping their order.
+        """
+        if self._trained_dead == 0:
+            return
+
+        descriptions = list(self.trained_)
+        ranges = np.array([self.trained_[d][1:] for d in descriptions],dtype=np.int64).reshape(-1,2)
+        n_tokens = ranges[:,1] - ranges[:,0]
+        positions = self._ranges(ranges[:,0],n_tokens)
+
+        labels = np.frombuffer(self._trained_labels,dtype=np.int8)[positions]
+        indptr = np.frombuffer(self._trained_indptr,dtype=np.int64)
+        n_features = (indptr[1:] - indptr[:-1])[positions]
+        indices = np.frombuffer(self._trained_indices,dtype=np.int32)[
+            self._ranges(indptr[positions],n_features)]
+
+        token_end = np.cumsum(n_tokens)
+        for comp_descr,start,end in zip(descriptions,token_end - n_tokens,token_end):
+            self.trained_[comp_descr] = (self.trained_[comp_descr][0],int(start),int(end))
+        self._trained_labels = array('b',labels.tobytes())
+        self._trained_indptr = array('q',[0])
+        self._trained_indptr.frombytes(np.cumsum(n_features).astype(np.int64).tobytes())
+        self._trained_indices = array('i',indices.tobytes())
+        self._trained_dead = 0
+
+    def partial_fit(self,store,rows,companies):
+        """Updates the model with stored descriptions and their company names
+
+        Typically the description and company_lst_name columns of
+        comp_name_compare once the company names have been corrected.  A
+        token is labelled as part of the name if it is one of the words of
+        the company name.  Descriptions already fitted with the same
+        company name are skipped, and those fitted with another company
+        name first have their old counts removed.  The trained arrays are
+        compacted once half of their tokens belong to removed descriptions.
+
+        Parameters
+        ----------
+        store : parsed_store
+            Store holding the parsed descriptions.
+        rows : list
+            Entry numbers of the descriptions in the store.
+        companies : list
+            Company name of each description.
+
+        returns self
+        """
+        # The last company name given for a description wins
+        new_rows = {}
+        for idx,company in zip(rows,companies):
+            comp_descr = store.descriptions[idx]
+            new_rows.pop(comp_descr,None)
+            if not self.is_trained(comp_descr,company):
+                new_rows[comp_descr] = (idx,company)
+        if len(new_rows) == 0:
+            return self
+
+        for comp_descr in new_rows:
+            if comp_descr in self.trained_:
+                self._forget(comp_descr)
+
+        rows = [idx for idx,_ in new_rows.values()]
+        companies = [company for _,company in new_rows.values()]
+        indices,indptr,token_rows,token_ids = self.featurize(store,rows)
+        labels = self.token_labels(store,token_rows,token_ids,companies)
+        self.feature_count_ += self._feature_counts(labels,indptr,indices)
+        self.class_count_ += np.bincount(labels,minlength=2)
+
+        # Keeps what was fitted for each description so it can be removed
+        # if its company name is corrected later
+        token_end = len(self._trained_labels) + np.cumsum(np.bincount(token_rows,minlength=len(rows)))
+        token_start = np.concatenate(([len(self._trained_labels)],token_end[:-1]))
+        for comp_descr,company,start,end in zip(new_rows,companies,token_start,token_end):
+            self.trained_[comp_descr] = (str(company),int(start),int(end))
+        self._trained_indptr.frombytes((self._trained_indptr[-1] + indptr[1:]).astype(np.int64).tobytes())
+        self._trained_labels.frombytes(labels.astype(np.int8).tobytes())
+        self._trained_indices.frombytes(indices.astype(np.int32).tobytes())
+        if 2*self._trained_dead >= len(self._trained_labels):
+            self._compact()
+        self._update_log_prob()
+
+        return self
+
+    def _update_log_prob(self):
+        smoothed = self.feature_count_ + self.alpha
+        self.feature_log_prob_ = np.log(smoothed) - np.log(smoothed.sum(axis=1,keepdims=True))
+        prior = self.class_count_ + 1
+        self.class_log_prior_ = np.log(prior) - np.log(prior.sum())
+
+    def token_proba(self,indices,indptr):
+        """Probability of each token being part of the company name
+
+        The log likelihoods of all features of all tokens are gathered in
+        one step and summed per token with np.add.reduceat.
+        """
+        if len(indptr) < 2:
+            return np.zeros(0)
+        gathered = self.feature_log_prob_[:,indices]
+        joint = np.add.reduceat(gathered,indptr[:-1],axis=1) + self.class_log_prior_[:,np.newaxis]
+        return 1.0/(1.0 + np.exp(joint[0] - joint[1]))
+
+    def predict_batch(self,store,rows):
+        """Predicted company name for many stored descriptions at once
+
+        As in company_name_full, a single token description is kept whole
+        and '&', 'and' and 'the' are always kept, otherwise the tokens with
+        a probability above 0.5 form the name.
+
+        Parameters
+        ----------
+        store : parsed_store
+            Store holding the parsed descriptions.
+        rows : list
+            Entry numbers of the descriptions in the store.
+
+        Attributes
+        ----------
+        comp_names : list
+            Predicted company name for each description.
+        """
+        indices,indptr,token_rows,token_ids = self.featurize(store,rows)
+        in_name = self.token_proba(indices,indptr) > 0.5
+        n_tokens = np.bincount(token_rows,minlength=len(rows))
+
+        comp_parts = [[] for _ in rows]
+        for r,token_id,keep in zip(token_rows,token_ids,in_name):
+            token = store.vocab.token(token_id)
+            if keep or (token in self.accepted_parts) or (n_tokens[r] == 1):
+                comp_parts[r].append(token)
+
+        return [' '.join(parts) for parts in comp_parts]
+
+    @staticmethod
+    def _npz_path(path):
+        # np.savez adds .npz to a path without it, np.load does not
+        return path if path.endswith('.npz') else path + '.npz'
+
+    def save(self,path):
+        """Saves the model counts and trained descriptions to an uncompressed .npz file
+
+        The .npz suffix is added to path if missing, as load does.  The
+        tokens of removed descriptions are compacted out first.
+        """
+        self._compact()
+        descriptions = list(self.trained_)
+        trained = np.array([self.trained_[d][1:] for d in descriptions],dtype=np.int64).reshape(-1,2)
+        np.savez(self._npz_path(path),class_count=self.class_count_,feature_count=self.feature_count_,
+                 params=np.array([self.n_features,self.alpha,self.ngram]),
+                 trained_descriptions=np.array(descriptions,dtype=str),
+                 trained_companies=np.array([self.trained_[d][0] for d in descriptions],dtype=str),
+                 trained_tokens=trained,
+                 trained_labels=np.asarray(self._trained_labels,dtype=np.int8),
+                 trained_indptr=np.asarray(self._trained_indptr,dtype=np.int64),
+                 trained_indices=np.asarray(self._trained_indices,dtype=np.int32))
+
+    def load(self,path):
+        """Loads model counts and trained descriptions saved with save
+
+        The same path as given to save can be used, with or without the
+        .npz suffix.
+
+        returns self
+        """
+        with np.load(self._npz_path(path)) as data:
+            n_features,alpha,ngram = data['params']
+            self.n_features = int(n_features)
+            self.alpha = float(alpha)
+            self.ngram = int(ngram)
+            self.class_count_ = data['class_count']
+            self.feature_count_ = data['feature_count']
+            self._reset_trained()
+            for comp_descr,company,(start,end) in zip(data['trained_descriptions'],
+                                                     data['trained_companies'],
+                                                     data['trained_tokens']):
+                self.trained_[str(comp_descr)] = (str(company),int(start),int(end))
+            self._trained_labels.extend(data['trained_labels'].tolist())
+            self._trained_indptr = array('q',data['trained_indptr'].tolist())
+            self._trained_indices.extend(data['trained_indices'].tolist())
+        self._reset_caches()
+        self._update_log_prob()
+
+        return self
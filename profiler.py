@@ -0,0 +1,172 @@
+import os
+import timeit
+from collections import defaultdict
+
+
+class _null_stage():
+    """Context manager doing nothing, handed out when profiling is disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        return False
+
+
+_NULL_STAGE = _null_stage()
+
+
+class _timed_stage():
+    """Context manager adding the elapsed time of the block to a stage"""
+
+    __slots__ = ('profiler','name','start')
+
+    def __init__(self,profiler,name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = timeit.default_timer()
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        elapsed = timeit.default_timer() - self.start
+        self.profiler.timings_[self.name] += elapsed
+        self.profiler.calls_[self.name] += 1
+        return False
+
+
+class stage_profiler():
+    """Collects timings and counters for each stage of a run
+
+    Wraps the stages of description_parser and company_type (tokenization,
+    dictionary lookups, frequency queries, POS tagging, SQL writes, HTTP
+    calls, distance matrix...) so a slow run can be broken down by where
+    the time went.  When disabled, stage() hands back a shared do nothing
+    context manager and the counters return straight away, so leaving the
+    hooks in place costs close to nothing.
+
+    Parameters
+    ----------
+    enabled : bool
+        If False no timings or counters are recorded.
+
+    Attributes
+    ----------
+    timings_ : dict
+        Total seconds spent in each stage.
+    calls_ : dict
+        Number of times each stage was entered.
+    counters_ : dict
+        Event counters (i.e. number of Places API calls).
+    cache_hits_ : dict
+        Hit count for each cache.
+    cache_misses_ : dict
+        Miss count for each cache.
+    """
+
+    def __init__(self,enabled=True):
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self):
+        """Clears all recorded timings and counters"""
+        self.timings_ = defaultdict(float)
+        self.calls_ = defaultdict(int)
+        self.counters_ = defaultdict(int)
+        self.cache_hits_ = defaultdict(int)
+        self.cache_misses_ = defaultdict(int)
+
+    def stage(self,name):
+        """Returns a context manager timing the enclosed block as stage name"""
+        if not self.enabled:
+            return _NULL_STAGE
+        return _timed_stage(self,name)
+
+    def count(self,name,n=1):
+        """Increments the event counter name by n"""
+        if self.enabled:
+            self.counters_[name] += n
+
+    def cache_hit(self,name):
+        """Records a hit for the cache name"""
+        if self.enabled:
+            self.cache_hits_[name] += 1
+
+    def cache_miss(self,name):
+        """Records a miss for the cache name"""
+        if self.enabled:
+            self.cache_misses_[name] += 1
+
+    def summary(self):
+        """Structured summary of everything recorded so far
+
+        Attributes
+        ----------
+        summary : dict
+            With keys stages (calls, total and mean seconds per stage),
+            counters and caches (hits, misses and hit ratio per cache).
+        """
+        stages = {}
+        for name,total in self.timings_.items():
+            calls = self.calls_[name]
+            stages[name] = {'calls':calls,
+                            'total_s':total,
+                            'mean_s':total/calls if calls else 0.0}
+
+        caches = {}
+        for name in set(self.cache_hits_) | set(self.cache_misses_):
+            hits = self.cache_hits_[name]
+            misses = self.cache_misses_[name]
+            lookups = hits + misses
+            caches[name] = {'hits':hits,
+                            'misses':misses,
+                            'hit_ratio':float(hits)/lookups if lookups else 0.0}
+
+        return {'stages':stages,
+                'counters':dict(self.counters_),
+                'caches':caches}
+
+    def prometheus_text(self,prefix='account_analysis'):
+        """Renders the recorded metrics in the Prometheus text format"""
+        lines = []
+
+        def family(name,help_text,label,values):
+            metric = '%s_%s' % (prefix,name)
+            lines.append('# HELP %s %s' % (metric,help_text))
+            lines.append('# TYPE %s counter' % metric)
+            for key in sorted(values):
+                lines.append('%s{%s="%s"} %s' % (metric,label,key,repr(values[key])))
+
+        family('stage_seconds_total','Time spent in each stage.',
+               'stage',self.timings_)
+        family('stage_calls_total','Number of times each stage ran.',
+               'stage',self.calls_)
+        family('events_total','Event counters.',
+               'event',self.counters_)
+        family('cache_hits_total','Cache hits.',
+               'cache',self.cache_hits_)
+        family('cache_misses_total','Cache misses.',
+               'cache',self.cache_misses_)
+        return '\n'.join(lines) + '\n'
+
+    def prometheus_export(self,path,prefix='account_analysis'):
+        """Writes the metrics in Prometheus text format to a file
+
+        The file is written next to the target and then moved in place so
+        a textfile collector never reads a half written file.
+
+        Parameters
+        ----------
+        path : string
+            Path of the .prom file to write.
+        prefix : string
+            Prefix given to every metric name.
+        """
+        tmp_path = path + '.tmp'
+        with open(tmp_path,'w') as f:
+            f.write(self.prometheus_text(prefix))
+        os.replace(tmp_path,path)
+
+
+null_profiler = stage_profiler(enabled=False)
@@ -0,0 +1,212 @@
+from collections import defaultdict
+from profiler import null_profiler
+
+class spend_rollup():
+    """Precomputed spending totals for the dashboard
+
+    Maintains the table spend_rollup, holding the sum and count of the
+    expenses in exp_type_loc for every combination of date, comp_type,
+    general_name and city at three levels: day, month (dy = 0) and year
+    (mnth = 0, dy = 0).  The table is updated incrementally with the rows
+    added to exp_type_loc, so dashboard slices are answered from a few
+    rows per group instead of scanning every transaction.  The last
+    exp_type_loc rowid added up is kept in the table spend_rollup_state,
+    so rows inserted while no rollup was attached are picked up by the
+    next update.  The tables are created on first use if rollup_init was
+    not called.
+
+        Parameters
+        ----------
+        conn : sqlite3 db connection
+            SQLITE database connection
+        profiler : stage_profiler
+            Optional profiler recording timings of the rollup stages,
+            profiling is disabled if not given.
+    """
+
+    dimensions = ('comp_type','general_name','city')
+    date_columns = ('yr','mnth','dy')
+
+    def __init__(self,conn,profiler=None):
+        self.conn = conn
+        self.profiler = profiler if profiler is not None else null_profiler
+        self._table_ready = False
+
+    def rollup_init(self,commit=True):
+        """Creates the spend_rollup tables if they do not exist
+
+        The state starts at rowid 0, so the first update adds up every row
+        already in exp_type_loc.  Rollups kept without a state are cleared
+        to be rebuilt the same way.
+
+        Parameters
+        ----------
+        commit : bool
+            If False the caller commits.
+        """
+
+        sql_st = '''
+            CREATE TABLE IF NOT EXISTS spend_rollup(
+                level TEXT NOT NULL,
+                yr INTEGER NOT NULL,
+                mnth INTEGER NOT NULL,
+                dy INTEGER NOT NULL,
+                comp_type TEXT NOT NULL,
+                general_name TEXT NOT NULL,
+                city TEXT NOT NULL,
+                total REAL NOT NULL,
+                n INTEGER NOT NULL,
+                PRIMARY KEY (level,yr,mnth,dy,comp_type,general_name,city))
+        '''
+        sql_state = '''
+            CREATE TABLE spend_rollup_state(
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                last_rowid INTEGER NOT NULL)
+        '''
+        cur = self.conn.cursor()
+        cur.execute(sql_st)
+        has_state = cur.execute('''
+            SELECT COUNT(*) FROM sqlite_master
+            WHERE type = 'table' AND name = 'spend_rollup_state'
+        ''').fetchone()[0]
+        if not has_state:
+            cur.execute(sql_state)
+            cur.execute('DELETE FROM spend_rollup')
+            cur.execute('INSERT INTO spend_rollup_state VALUES (0,0)')
+        if commit:
+            self.conn.commit()
+        self._table_ready = True
+
+    def last_rowid(self):
+        """Returns the last rowid of exp_type_loc in the rollups, 0 if none"""
+
+        if not self._table_ready:
+            self.rollup_init(commit=False)
+
+        cur = self.conn.cursor()
+        return cur.execute('SELECT last_rowid FROM spend_rollup_state').fetchone()[0]
+
+    def rollup_update(self,commit=True):
+        """Adds the exp_type_loc rows not yet in the rollups
+
+        The rows after last_rowid are grouped by day in SQL, the month and
+        year totals are summed from the day groups, then each group is
+        added to its rollup row (created at zero if new), as in
+        frequency_updater.  The new last rowid is stored with the totals.
+        If exp_type_loc shrank below last_rowid the rollups are rebuilt.
+
+        Parameters
+        ----------
+        commit : bool
+            If False the caller commits, so the rollups can be updated in
+            the same transaction as the rows they aggregate.
+        """
+
+        sql_st = '''
+            SELECT IFNULL(yr,0), IFNULL(mnth,0), IFNULL(dy,0),
+                IFNULL(comp_type,''), IFNULL(general_name,''), IFNULL(city,''),
+                TOTAL(value), COUNT(*)
+            FROM exp_type_loc
+            WHERE rowid > ? AND rowid <= ?
+            GROUP BY 1,2,3,4,5,6
+        '''
+        sql_insert = '''
+            INSERT OR IGNORE INTO spend_rollup
+            VALUES (?,?,?,?,?,?,?,0,0)
+        '''
+        sql_add = '''
+            UPDATE spend_rollup
+             SET total = total + ?, n = n + ?
+            WHERE level = ? AND yr = ? AND mnth = ? AND dy = ?
+                AND comp_type = ? AND general_name = ? AND city = ?
+        '''
+
+        from_rowid = self.last_rowid()
+        cur = self.conn.cursor()
+        to_rowid = cur.execute('SELECT IFNULL(MAX(rowid),0) FROM exp_type_loc').fetchone()[0]
+        if to_rowid < from_rowid:
+            return self.rollup_rebuild(commit=commit)
+
+        with self.profiler.stage('rollup_aggregate'):
+            day_groups = cur.execute(sql_st,(from_rowid,to_rowid)).fetchall()
+            groups = defaultdict(lambda: [0.0,0])
+            for yr,mnth,dy,comp_type,general_name,city,total,n in day_groups:
+                for key in (('day',yr,mnth,dy),('month',yr,mnth,0),('year',yr,0,0)):
+                    group = groups[key + (comp_type,general_name,city)]
+                    group[0] += total
+                    group[1] += n
+
+        with self.profiler.stage('sql_write'):
+            cur.executemany(sql_insert,list(groups.keys()))
+            cur.executemany(sql_add,[(total,n) + key for key,(total,n) in groups.items()])
+            cur.execute('UPDATE spend_rollup_state SET last_rowid = ?',(to_rowid,))
+            if commit:
+                self.conn.commit()
+
+    def rollup_rebuild(self,commit=True):
+        """Recomputes the rollups from the full exp_type_loc table
+
+        Parameters
+        ----------
+        commit : bool
+            If False the caller commits.
+        """
+
+        if not self._table_ready:
+            self.rollup_init(commit=False)
+
+        cur = self.conn.cursor()
+        cur.execute('DELETE FROM spend_rollup')
+        cur.execute('UPDATE spend_rollup_state SET last_rowid = 0')
+        self.rollup_update(commit=commit)
+
+    def spend(self,by=('yr','mnth'),**filters):
+        """Answers a dashboard slice from the rollups
+
+        The coarsest level holding the date columns used is read, i.e.
+        spend(by=('yr','mnth','comp_type')) reads the month rollups and
+        spend(by=('city',),yr=2017) the year rollups.
+
+        Parameters
+        ----------
+        by : tuple
+            Columns to group on, from yr, mnth, dy, comp_type,
+            general_name and city.
+        filters : dict
+            Equality filters on the same columns, i.e. comp_type='cafe'.
+
+        Attributes
+        ----------
+        spend : list
+            A tuple per group with the by columns, the total spent and
+            the number of expenses.
+        """
+
+        columns = self.date_columns + self.dimensions
+        for column in tuple(by) + tuple(filters):
+            if column not in columns:
+                raise ValueError('Unknown rollup column: %s' % column)
+
+        used = set(by) | set(filters)
+        if 'dy' in used:
+            level = 'day'
+        elif 'mnth' in used:
+            level = 'month'
+        else:
+            level = 'year'
+
+        where = ['level = ?'] + ['%s = ?' % column for column in filters]
+        params = [level] + list(filters.values())
+        select = list(by) + ['SUM(total)','SUM(n)']
+        sql_st = 'SELECT %s FROM spend_rollup WHERE %s' % (', '.join(select),' AND '.join(where))
+        if len(by) > 0:
+            sql_st += ' GROUP BY %s ORDER BY %s' % (', '.join(by),', '.join(by))
+
+        if not self._table_ready:
+            self.rollup_init()
+
+        with self.profiler.stage('rollup_query'):
+            cur = self.conn.cursor()
+            spend = cur.execute(sql_st,params).fetchall()
+
+        return spend
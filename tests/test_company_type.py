@@ -0,0 +1,115 @@
+import sqlite3
+import pytest
+
+pytest.importorskip('fuzzy')
+from company_type import company_type
+from spend_rollup import spend_rollup
+
+SCHEMA = [
+    '''CREATE TABLE geo_expense_data(id INTEGER PRIMARY KEY, load_id, yr, mnth, dy, general_name,
+        country, city, postcode, state, address, lat, lng, value)''',
+    '''CREATE TABLE exp_comp_type(geo_expense_id INTEGER UNIQUE, goog_name, comp_type, address,
+        placeid, goog_lat, goog_lng)''',
+    'CREATE TABLE defined_company_types(id, description, company, comp_type)',
+    'CREATE TABLE goog_locations(yr, mnth, dy, lat, lng)',
+    '''CREATE TABLE exp_type_loc(yr, mnth, dy, general_name, goog_name, comp_type,
+        country, city, state, postcode, lat, lng, goog_lat, goog_lng, value)''',
+]
+
+
+def add_expense(conn,expense_id,yr,mnth,dy,general_name,value):
+    conn.execute('INSERT INTO geo_expense_data VALUES (?,1,?,?,?,?,?,?,?,?,?,?,?,?)',
+                 (expense_id,yr,mnth,dy,general_name,'us','sf','','ca','',37.0,-122.0,value))
+    conn.commit()
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    for sql_st in SCHEMA:
+        conn.execute(sql_st)
+    for mnth in range(1,13):
+        add_expense(conn,mnth,2017,mnth,5,'netflix',9.99)
+        add_expense(conn,mnth + 100,2017,mnth,6,'blue bottle',4.5)
+        add_expense(conn,mnth + 200,2017,mnth,7,None,4.5)
+    yield conn
+    conn.close()
+
+
+def loader(conn,**kwargs):
+    ct = company_type(conn,**kwargs)
+    ct.google_search = lambda comp_name,lat,lng: []
+    return ct
+
+
+def n_rows(conn):
+    return conn.execute('SELECT COUNT(*) FROM exp_type_loc').fetchone()[0]
+
+
+def test_streaming_after_full_mode_adds_only_new_rows(conn):
+    ct = loader(conn)
+    ct.company_info_loader()
+    assert n_rows(conn) == 36
+
+    add_expense(conn,999,2018,1,1,'newco',3.0)
+    ct.company_info_loader(page_size=5)
+    assert n_rows(conn) == 37
+    assert conn.execute('''SELECT COUNT(DISTINCT geo_expense_id) FROM exp_type_loc
+                           WHERE geo_expense_id IS NOT NULL''').fetchone()[0] == 37
+
+    ct.company_info_loader(page_size=5)
+    assert n_rows(conn) == 37
+
+
+def test_streaming_runs_add_each_transaction_once(conn):
+    ct = loader(conn)
+    ct.company_info_loader(page_size=5)
+    add_expense(conn,999,2018,1,1,'newco',3.0)
+    ct.company_info_loader(page_size=5)
+    ct.company_info_loader(page_size=5)
+    assert n_rows(conn) == 37
+
+
+def test_unprocessed_records_pages_over_missing_dates(conn):
+    add_expense(conn,1000,None,None,None,'x',3.0)
+    add_expense(conn,1001,None,None,None,'y',3.0)
+    ids = [record[0] for record in loader(conn).unprocessed_records(page_size=1)]
+    assert ids[:2] == [1000,1001]
+    assert sorted(ids) == sorted(row[0] for row in conn.execute('SELECT id FROM geo_expense_data'))
+
+
+def table_total(conn):
+    return conn.execute('SELECT TOTAL(value), COUNT(*) FROM exp_type_loc').fetchone()
+
+
+def test_rollup_follows_exp_type_loc_table(conn):
+    loader(conn).company_info_loader(page_size=5)
+
+    rollup = spend_rollup(conn)
+    ct = loader(conn,rollup=rollup)
+    add_expense(conn,999,2018,1,1,'newco',3.0)
+    ct.company_info_loader(page_size=5)
+    total,n = rollup.spend(by=())[0]
+    assert (round(total,6),n) == (round(table_total(conn)[0],6),table_total(conn)[1])
+    assert n == 37
+
+    add_expense(conn,1000,2018,2,1,'newco',4.0)
+    ct.data_stream(page_size=5)
+    ct.exp_type_loc_table(only_new=True)
+    expected = conn.execute('''
+        SELECT yr, TOTAL(value), COUNT(*) FROM exp_type_loc GROUP BY yr ORDER BY yr''').fetchall()
+    assert [(yr,round(total,6),n) for yr,total,n in rollup.spend(by=('yr',))] == \
+        [(yr,round(total,6),n) for yr,total,n in expected]
+
+
+def test_rollup_rebuilt_when_full_mode_rows_are_rekeyed(conn):
+    rollup = spend_rollup(conn)
+    ct = loader(conn,rollup=rollup)
+    ct.company_info_loader()
+    assert rollup.spend(by=())[0][-1] == 36
+
+    add_expense(conn,999,2018,1,1,'newco',3.0)
+    ct.company_info_loader(page_size=5)
+    total,n = rollup.spend(by=())[0]
+    assert n == 37
+    assert round(total,6) == round(table_total(conn)[0],6)
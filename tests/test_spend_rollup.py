@@ -0,0 +1,121 @@
+import math
+import random
+import sqlite3
+import pytest
+from spend_rollup import spend_rollup
+
+EXP_TYPE_LOC = '''
+    CREATE TABLE exp_type_loc(yr, mnth, dy, general_name, goog_name, comp_type,
+        country, city, state, postcode, lat, lng, goog_lat, goog_lng, value)
+'''
+
+SLICES = [
+    ('yr',),
+    ('yr','mnth'),
+    ('yr','mnth','dy'),
+    ('comp_type',),
+    ('general_name','city'),
+    ('yr','mnth','comp_type'),
+    ('yr','mnth','dy','comp_type','general_name','city'),
+]
+
+
+def load_batch(conn,rng,n_rows):
+    rows = []
+    for _ in range(n_rows):
+        rows.append((rng.choice([2017,2018]),rng.randint(1,12),rng.randint(1,28),
+                     rng.choice(['starbucks','amazon','peets',None]),'',
+                     rng.choice(['cafe','online','store','']),
+                     'us',rng.choice(['san francisco','new york',None]),'ca','',
+                     0.0,0.0,'','',
+                     rng.choice([round(rng.uniform(1,100),2),None])))
+    conn.executemany('INSERT INTO exp_type_loc VALUES (%s)' % ','.join('?'*15),rows)
+
+
+def full_recomputation(conn,by,**filters):
+    columns = ["IFNULL(%s,'')" % c if c in spend_rollup.dimensions else c for c in by]
+    where = ' AND '.join(["IFNULL(%s,'') = ?" % c if c in spend_rollup.dimensions else '%s = ?' % c
+                          for c in filters]) or '1'
+    sql_st = 'SELECT %s, TOTAL(value), COUNT(*) FROM exp_type_loc WHERE %s GROUP BY %s ORDER BY %s' % (
+        ', '.join(columns),where,', '.join(columns),', '.join(columns))
+    return conn.execute(sql_st,list(filters.values())).fetchall()
+
+
+def assert_same(spend,expected):
+    assert len(spend) == len(expected)
+    for row,expected_row in zip(spend,expected):
+        assert row[:-2] == expected_row[:-2]
+        assert math.isclose(row[-2],expected_row[-2],abs_tol=1e-6)
+        assert row[-1] == expected_row[-1]
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.execute(EXP_TYPE_LOC)
+    yield conn
+    conn.close()
+
+
+def test_incremental_rollups_match_full_recomputation(conn):
+    rng = random.Random(0)
+    rollup = spend_rollup(conn)
+    for n_rows in (150,1,0,300):
+        load_batch(conn,rng,n_rows)
+        rollup.rollup_update()
+        for by in SLICES:
+            assert_same(rollup.spend(by=by),full_recomputation(conn,by))
+
+
+def test_filtered_slices_match_full_recomputation(conn):
+    rng = random.Random(1)
+    rollup = spend_rollup(conn)
+    for _ in range(3):
+        load_batch(conn,rng,100)
+        rollup.rollup_update()
+
+    assert_same(rollup.spend(by=('city',),yr=2017,comp_type='cafe'),
+                full_recomputation(conn,('city',),yr=2017,comp_type='cafe'))
+    assert_same(rollup.spend(by=('dy',),yr=2018,mnth=3),
+                full_recomputation(conn,('dy',),yr=2018,mnth=3))
+
+
+def test_rebuild_matches_incremental(conn):
+    rng = random.Random(2)
+    rollup = spend_rollup(conn)
+    for _ in range(4):
+        load_batch(conn,rng,80)
+        rollup.rollup_update()
+    incremental = dict((by,rollup.spend(by=by)) for by in SLICES)
+
+    rollup.rollup_rebuild()
+    for by in SLICES:
+        assert_same(rollup.spend(by=by),incremental[by])
+
+
+def test_table_created_on_first_use(conn):
+    load_batch(conn,random.Random(3),10)
+    rollup = spend_rollup(conn)
+    rollup.rollup_update(commit=False)
+    conn.commit()
+    assert rollup.spend(by=())[0][-1] == 10
+    assert spend_rollup(conn).spend(by=('yr',)) == rollup.spend(by=('yr',))
+
+
+def test_rows_inserted_without_the_rollup_are_added(conn):
+    rng = random.Random(4)
+    load_batch(conn,rng,50)
+    rollup = spend_rollup(conn)
+    load_batch(conn,rng,20)
+    rollup.rollup_update()
+    assert rollup.last_rowid() == 70
+
+    load_batch(conn,rng,30)
+    spend_rollup(conn).rollup_update()
+    assert_same(rollup.spend(by=('yr','mnth')),full_recomputation(conn,('yr','mnth')))
+    assert rollup.spend(by=())[0][-1] == 100
+
+
+def test_unknown_column_rejected(conn):
+    with pytest.raises(ValueError):
+        spend_rollup(conn).spend(by=('value',))
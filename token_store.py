@@ -0,0 +1,220 @@
+from array import array
+import sys
+import re
+import numpy as np
+
+
+class token_vocab():
+    """Maps token strings to int ids
+
+    Each distinct token is stored once and descriptions then only hold
+    the int32 ids of their tokens.
+
+    Attributes
+    ----------
+    ids_ : dict
+        Token string to id.
+    tokens_ : list
+        Token string for each id.
+    """
+
+    def __init__(self):
+        self.ids_ = {}
+        self.tokens_ = []
+
+    def __len__(self):
+        return len(self.tokens_)
+
+    def intern(self,token):
+        """Returns the id of token, adding it to the vocabulary if new"""
+        token_id = self.ids_.get(token)
+        if token_id is None:
+            token_id = len(self.tokens_)
+            token = sys.intern(token)
+            self.ids_[token] = token_id
+            self.tokens_.append(token)
+        return token_id
+
+    def token(self,token_id):
+        """Returns the token string for token_id"""
+        return self.tokens_[token_id]
+
+
+class parsed_description():
+    """Tags of a single parsed description, as returned by parsed_store
+
+    Parameters
+    ----------
+    description : string
+        Containing company description from statement.
+    token_ids : array
+        Vocabulary id of each token of the description.
+    pos_ids : array
+        Parts of speech vocabulary id of each token.
+    features : array
+        n_tokens by n_features float32 array of the numeric tags, in the
+        order of parsed_store.feature_names.
+    """
+
+    __slots__ = ('description','token_ids','pos_ids','features')
+
+    def __init__(self,description,token_ids,pos_ids,features):
+        self.description = description
+        self.token_ids = token_ids
+        self.pos_ids = pos_ids
+        self.features = features
+
+
+class parsed_store():
+    """Compact columnar store of parsed descriptions
+
+    Holds the output of description_parser.comp_word_parser for many
+    descriptions without the nested dicts of lists.  Token and parts of
+    speech strings are interned into vocabularies, and the tags of every
+    token of every description are appended to flat typed arrays, with
+    offsets marking where each description starts.  A token costs 4 bytes
+    for its id, 4 for its parts of speech and 4 per numeric tag.  Each
+    description is stored once, parsing it again leaves the store as is.
+
+    Attributes
+    ----------
+    vocab : token_vocab
+        Vocabulary of the description tokens.
+    pos_vocab : token_vocab
+        Vocabulary of the parts of speech tags.
+    descriptions : list
+        Description string of each entry.
+    index_ : dict
+        Entry number of each description.
+    """
+
+    feature_names = ('is_word_term','embedded_word','word_struc',
+                     'prev_count','word_phon_count','len_word_points')
+
+    def __init__(self):
+        self.vocab = token_vocab()
+        self.pos_vocab = token_vocab()
+        self.descriptions = []
+        self.index_ = {}
+        self.token_ids = array('i')
+        self.pos_ids = array('i')
+        self.features = array('f')
+        self.offsets = array('q',[0])
+
+    def __len__(self):
+        return len(self.descriptions)
+
+    def __contains__(self,comp_descr):
+        return comp_descr in self.index_
+
+    def index(self,comp_descr):
+        """Returns the entry number of comp_descr, None if not stored"""
+        return self.index_.get(comp_descr)
+
+    def append(self,comp_descr,word_comp):
+        """Adds the tags of a parsed description to the store
+
+        A description already stored is not added again.
+
+        Parameters
+        ----------
+        comp_descr : string
+            Containing company description from statement.
+        word_comp : dict
+            Tags for each word of the description, as found under
+            comp_descr in the dictionary returned by comp_word_parser.
+
+        Attributes
+        ----------
+        idx : int
+            Entry number of the description.
+        """
+        idx = self.index_.get(comp_descr)
+        if idx is not None:
+            return idx
+
+        for word,tags in word_comp.items():
+            (is_word_term,embedded_word,word_struc,prev_count,pos,
+             word_phon_count,len_word_points) = tags
+            self.token_ids.append(self.vocab.intern(word))
+            self.pos_ids.append(self.pos_vocab.intern(pos))
+            self.features.extend((is_word_term,embedded_word,word_struc,
+                                  prev_count,word_phon_count,len_word_points))
+        idx = len(self.descriptions)
+        self.descriptions.append(comp_descr)
+        self.index_[comp_descr] = idx
+        self.offsets.append(len(self.token_ids))
+        return idx
+
+    def __getitem__(self,idx):
+        start = self.offsets[idx]
+        end = self.offsets[idx + 1]
+        n_features = len(self.feature_names)
+        features = np.array(self.features[start*n_features:end*n_features],
+                            dtype=np.float32).reshape(-1,n_features)
+        return parsed_description(self.descriptions[idx],
+                                  self.token_ids[start:end],
+                                  self.pos_ids[start:end],
+                                  features)
+
+    def tags(self,idx):
+        """Rebuilds the comp_word_parser dictionary for entry idx
+
+        Attributes
+        ----------
+        tag_comp : dict
+            {description: {word: [is_word_term,embedded_word,word_struc,
+            prev_count,pos,word_phon_count,len_word_points]}}
+        """
+        parsed = self[idx]
+        word_comp = dict()
+        for token_id,pos_id,row in zip(parsed.token_ids,parsed.pos_ids,
+                                       parsed.features):
+            word_comp[self.vocab.token(token_id)] = [
+                int(row[0]),bool(row[1]),bool(row[2]),np.float64(row[3]),
+                self.pos_vocab.token(pos_id),np.float64(row[4]),int(row[5])]
+        return {parsed.description:word_comp}
+
+
+def letter_mask(letters):
+    """Bit mask of the letters and digits in a string
+
+    Letters a-z take bits 0-25 and digits 0-9 bits 26-35, so subset
+    checks between letter sets are integer operations.
+    """
+    mask = 0
+    for letter in letters:
+        if 'a' <= letter <= 'z':
+            mask |= 1 << (ord(letter) - ord('a'))
+        elif '0' <= letter <= '9':
+            mask |= 1 << (26 + ord(letter) - ord('0'))
+    return mask
+
+
+class comp_compare_row():
+    """Single comp_name_compare row used in company name disambiguation
+
+    Parameters
+    ----------
+    description : string
+        Containing company description from statement.
+    company : string
+        Predicted company name.
+    phonetics : tuple
+        Both double metaphone codes of the company name.
+    first_letter : string
+        First letter of the company name.
+    set_letters : string
+        Set of letters of the first word as stored in comp_name_compare.
+    """
+
+    __slots__ = ('description','company','phonetics','first_letter',
+                 'letter_mask','n_letters')
+
+    def __init__(self,description,company,phonetics,first_letter,set_letters):
+        self.description = description
+        self.company = sys.intern(company) if company else company
+        self.phonetics = phonetics
+        self.first_letter = first_letter
+        self.letter_mask = letter_mask(re.findall("\'([a-z0-9])\'",set_letters))
+        self.n_letters = bin(self.letter_mask).count('1')